@@ -1,20 +1,33 @@
+import heapq
 import json
 import os
 import random
+import re
 import secrets
-from collections import defaultdict
-from datetime import datetime, timedelta
+import stat
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from itertools import accumulate
+from math import log
+from operator import itemgetter
 from urllib.parse import urlparse
 
 import click
+import orjson
 from argon2 import PasswordHasher
 from argon2.exceptions import (InvalidHashError, VerificationError,
                                VerifyMismatchError)
 from dotenv import load_dotenv
-from flask import (Flask, jsonify, redirect, render_template, request, session,
-                   url_for)
-from google import genai
-from openai import OpenAI
+from flask import (Flask, g, jsonify, redirect, render_template, request,
+                   session, url_for)
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
 
 from utils.calendar_utils import (add_meal_plan_to_calendar,
                                   exchange_code_for_token,
@@ -24,14 +37,44 @@ from utils.calendar_utils import (add_meal_plan_to_calendar,
 
 load_dotenv()
 
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson for faster (de)serialization."""
+
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        """Serialize data as a JSON string."""
+        return orjson.dumps(obj, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        """Deserialize data from a JSON string or bytes."""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Build a JSON response directly from orjson's bytes output."""
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self.option
+        if self._app.debug:
+            option |= orjson.OPT_INDENT_2
+        return self._app.response_class(
+            orjson.dumps(obj, option=option | orjson.OPT_APPEND_NEWLINE),
+            mimetype='application/json'
+        )
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config.update({
-    'SECRET_KEY': os.getenv('SECRET_KEY') or os.urandom(32),
     'SESSION_COOKIE_HTTPONLY': True,
     'SESSION_COOKIE_SAMESITE': os.getenv('SESSION_COOKIE_SAMESITE', 'Lax'),
     'SESSION_COOKIE_SECURE': os.getenv('SESSION_COOKIE_SECURE', 'false').lower() == 'true',
-    'PERMANENT_SESSION_LIFETIME': timedelta(hours=max(1, int(os.getenv('SESSION_LIFETIME_HOURS', '12'))))
+    'PERMANENT_SESSION_LIFETIME': timedelta(hours=max(1, int(os.getenv('SESSION_LIFETIME_HOURS', '12')))),
+    # Compress rendered recipe and meal plan pages and larger JSON responses
+    'COMPRESS_ALGORITHM': ['br', 'gzip'],
+    'COMPRESS_MIN_SIZE': 1024
 })
+Compress(app)
 
 # AI Client Configuration
 AI_PROVIDER = os.getenv('AI_PROVIDER', 'openai').lower()
@@ -39,22 +82,95 @@ AI_BASE_URL = os.getenv('AI_BASE_URL', 'http://localhost:1234/v1')
 AI_API_KEY = os.getenv('AI_API_KEY', 'lm-studio')
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY', '')
 AI_MODEL = os.getenv('AI_MODEL', 'local-model')
+AI_TIMEOUT_SECONDS = float(os.getenv('AI_TIMEOUT_SECONDS', '120'))
+# Candidate lists smaller than this skip the AI round trip entirely
+AI_REORDER_MIN_RECIPES = max(1, int(os.getenv('AI_REORDER_MIN_RECIPES', '4')))
+# Number of AI selections remembered per process (0 disables the cache)
+AI_ORDER_CACHE_SIZE = max(0, int(os.getenv('AI_ORDER_CACHE_SIZE', '256')))
+# Stage plans immediately and let the AI choose meals in the background
+AI_BACKGROUND_SELECTION = os.getenv('AI_BACKGROUND_SELECTION', 'true').lower() == 'true'
+# Background selections older than this are treated as abandoned
+AI_BACKGROUND_TIMEOUT_SECONDS = 300
+AI_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ai-selection')
 
 # Data directory
 DATA_DIR = os.getenv('DATA_DIR') or os.path.join(os.path.dirname(__file__), 'data')
 RECIPES_FILE = os.path.join(DATA_DIR, 'recipes.json')
 MEAL_PLANS_FILE = os.path.join(DATA_DIR, 'meal_plans.json')
 USERS_FILE = os.path.join(DATA_DIR, 'users.json')
+# Pretty-print recipe and meal plan files for hand inspection
+DEBUG_JSON = os.getenv('DEBUG_JSON', 'false').lower() in ('1', 'true')
+# Meal plans listed per page on /meal-plans
+MEAL_PLANS_PAGE_SIZE = max(1, int(os.getenv('MEAL_PLANS_PAGE_SIZE', '25')))
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
 
+
+SECRET_KEY_BYTES = 32
+
+
+def _read_secret_key_file(key_file):
+    """Return the key stored in key_file, or None if it is missing or too short to be a real key."""
+    try:
+        with open(key_file, 'rb') as f:
+            key = f.read()
+    except FileNotFoundError:
+        return None
+    return key if len(key) >= SECRET_KEY_BYTES else None
+
+
+def _load_secret_key():
+    """Return SECRET_KEY from the environment, or a key persisted in the data directory."""
+    env_key = os.getenv('SECRET_KEY')
+    if env_key:
+        return env_key
+
+    # Persisting the key keeps sessions valid across restarts and reloader forks
+    key_file = os.path.join(DATA_DIR, '.secret_key')
+    key = _read_secret_key_file(key_file)
+    if key:
+        return key
+
+    # Write the key beside its final path and link it in whole, so no process reads a partial key
+    tmp = tempfile.NamedTemporaryFile(dir=DATA_DIR, prefix='.tmp-', suffix='.key', delete=False)
+    try:
+        with tmp:
+            tmp.write(secrets.token_bytes(SECRET_KEY_BYTES))
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        try:
+            os.link(tmp.name, key_file)
+        except FileExistsError:
+            # Another worker published its key first; a too-short file is left over from an interrupted write
+            if not _read_secret_key_file(key_file):
+                os.replace(tmp.name, key_file)
+    finally:
+        if os.path.exists(tmp.name):
+            os.unlink(tmp.name)
+
+    # Re-read so every worker that raced here ends up signing with the published key
+    return _read_secret_key_file(key_file)
+
+
+app.config['SECRET_KEY'] = _load_secret_key()
+
 # Login rate limiting
 MAX_LOGIN_ATTEMPTS = max(1, int(os.getenv('MAX_LOGIN_ATTEMPTS', '5')))
 LOGIN_RATE_LIMIT_WINDOW_MINUTES = max(1, int(os.getenv('LOGIN_RATE_LIMIT_WINDOW_MINUTES', '15')))
-LOGIN_ATTEMPTS = defaultdict(list)
+LOGIN_ATTEMPTS = {}
+# Identifiers whose attempts have all expired are swept out at most this often
+LOGIN_ATTEMPTS_SWEEP_SECONDS = 300
+_LAST_LOGIN_ATTEMPTS_SWEEP = time.monotonic()
+# Guards LOGIN_ATTEMPTS and its deques, which concurrent login requests prune and sweep
+_LOGIN_ATTEMPTS_LOCK = threading.Lock()
 
-PASSWORD_HASHER = PasswordHasher()
+# Argon2id cost settings; measure them on the target host with `flask argon2-calibrate`
+PASSWORD_HASHER = PasswordHasher(
+    time_cost=max(1, int(os.getenv('ARGON2_TIME_COST', '3'))),
+    memory_cost=max(8, int(os.getenv('ARGON2_MEMORY_KIB', '65536'))),
+    parallelism=max(1, int(os.getenv('ARGON2_PARALLELISM', '4')))
+)
 
 
 def hash_password(password):
@@ -104,8 +220,23 @@ def _normalize_users_data(data):
     }
 
 
+def _is_canonical_users_data(users_data):
+    """Return True when a users datastore needs no migration or normalization."""
+    return users_data.get('version') == 1 and all(
+        isinstance(user, dict)
+        and user.get('password_hash')
+        and not user.get('password')
+        and 'id' in user and 'created_at' in user and 'updated_at' in user
+        for user in users_data.get('users', [])
+    )
+
+
 def _migrate_users_data(users_data):
     """Migrate legacy user records to hashed-password format."""
+    # Stores already in the current format are returned as-is without copying records
+    if _is_canonical_users_data(users_data):
+        return users_data, False
+
     migrated = False
     now = datetime.now().isoformat()
 
@@ -139,8 +270,13 @@ def _migrate_users_data(users_data):
 
 def save_users(users):
     """Save users to JSON file in versioned format."""
-    with open(USERS_FILE, 'w') as f:
-        json.dump({'version': 1, 'users': users}, f, indent=2)
+    try:
+        _write_json_atomically(USERS_FILE, {'version': 1, 'users': users})
+    except Exception:
+        # Callers edit the cached list in place; forget it so reads go back to the file
+        _JSON_CACHE.pop(USERS_FILE, None)
+        raise
+    _JSON_CACHE[USERS_FILE] = {'signature': _file_signature(USERS_FILE), 'data': users}
 
 
 def ensure_users_store():
@@ -152,18 +288,40 @@ def ensure_users_store():
 
 
 def load_users():
-    """Load users from JSON file with legacy migration support."""
-    ensure_users_store()
+    """Load users from JSON file with legacy migration support.
+
+    The returned list is shared with the in-memory cache; callers that modify it
+    must persist the change with save_users().
+    """
+    # The cache signature stat doubles as the existence check
+    signature = _file_signature(USERS_FILE)
+    if signature is None:
+        ensure_users_store()
+        signature = _file_signature(USERS_FILE)
+
+    entry = _JSON_CACHE.get(USERS_FILE)
+    if entry and entry['signature'] == signature:
+        return entry['data']
 
-    with open(USERS_FILE, 'r') as f:
-        users_data = _normalize_users_data(json.load(f))
+    with open(USERS_FILE, 'rb') as f:
+        users_data = _normalize_users_data(orjson.loads(f.read()))
 
     migrated_data, changed = _migrate_users_data(users_data)
+    users = migrated_data.get('users', [])
     if changed or migrated_data.get('version') != users_data.get('version'):
-        with open(USERS_FILE, 'w') as f:
-            json.dump(migrated_data, f, indent=2)
+        save_users(users)
+    else:
+        _JSON_CACHE[USERS_FILE] = {'signature': signature, 'data': users}
+
+    return users
 
-    return migrated_data.get('users', [])
+
+def _index_users_by_username(users):
+    """Map lowercase usernames to user records, keeping the first duplicate."""
+    index = {}
+    for user in users:
+        index.setdefault(user.get('username', '').lower(), user)
+    return index
 
 
 def find_user_by_username(username):
@@ -172,23 +330,24 @@ def find_user_by_username(username):
     if not normalized_username:
         return None
 
-    users = load_users()
-    return next((u for u in users if u.get('username', '').lower() == normalized_username), None)
+    users_by_username = _get_store_index(USERS_FILE, 'by_username', _index_users_by_username,
+                                         loader=load_users)
+    return users_by_username.get(normalized_username)
 
 
 def update_user_password(username, new_password):
     """Update a user's password hash."""
-    users = load_users()
-    now = datetime.now().isoformat()
+    password_hash = hash_password(new_password)
 
-    for user in users:
-        if user.get('username', '').lower() == username.lower():
-            user['password_hash'] = hash_password(new_password)
-            user['updated_at'] = now
-            save_users(users)
-            return True
+    with _USERS_LOCK:
+        user = find_user_by_username(username)
+        if not user:
+            return False
 
-    return False
+        user['password_hash'] = password_hash
+        user['updated_at'] = datetime.now().isoformat()
+        save_users(load_users())
+    return True
 
 
 def create_user(username, password):
@@ -200,21 +359,25 @@ def create_user(username, password):
     if len(password or '') < 8:
         raise ValueError('Password must be at least 8 characters.')
 
-    users = load_users()
-    if any(u.get('username', '').lower() == normalized_username.lower() for u in users):
-        raise ValueError('User already exists.')
+    password_hash = hash_password(password)
 
-    now = datetime.now().isoformat()
-    user = {
-        'id': max([u.get('id', 0) for u in users], default=0) + 1,
-        'username': normalized_username,
-        'password_hash': hash_password(password),
-        'created_at': now,
-        'updated_at': now
-    }
+    with _USERS_LOCK:
+        users = load_users()
+        if find_user_by_username(normalized_username):
+            raise ValueError('User already exists.')
 
-    users.append(user)
-    save_users(users)
+        now = datetime.now().isoformat()
+        user = {
+            'id': _next_record_id(USERS_FILE, loader=load_users),
+            'username': normalized_username,
+            'password_hash': password_hash,
+            'created_at': now,
+            'updated_at': now
+        }
+
+        users.append(user)
+        save_users(users)
+        _record_new_id(USERS_FILE, user['id'])
     return user
 
 
@@ -240,10 +403,16 @@ def _is_json_request():
 
 def _get_or_create_csrf_token():
     """Return session CSRF token, creating one when needed."""
+    # Templates rendered in the same request reuse the token looked up first
+    token = g.get('csrf_token')
+    if token:
+        return token
+
     token = session.get('csrf_token')
     if not token:
         token = secrets.token_urlsafe(32)
         session['csrf_token'] = token
+    g.csrf_token = token
     return token
 
 
@@ -308,19 +477,16 @@ def _get_safe_next_url(default_endpoint='index'):
     return url_for(default_endpoint)
 
 
-def _get_safe_redirect_target(target_url, default_endpoint='index'):
-    """Return safe in-app redirect path, rejecting external URLs."""
-    default_url = url_for(default_endpoint)
-    if not target_url:
-        return default_url
-
+@lru_cache(maxsize=256)
+def _local_redirect_path(target_url):
+    """Return the in-app path for a redirect target, or None if it may leave the app."""
     # Normalize backslashes, which some browsers treat as path separators
     normalized_target = target_url.replace('\\', '/')
     parsed_url = urlparse(normalized_target)
 
     # Reject any URL that specifies a scheme or network location
     if parsed_url.scheme or parsed_url.netloc:
-        return default_url
+        return None
 
     # Only allow absolute paths within this application (no protocol-relative URLs)
     if parsed_url.path.startswith('/') and not parsed_url.path.startswith('//'):
@@ -329,7 +495,13 @@ def _get_safe_redirect_target(target_url, default_endpoint='index'):
             safe_path += f"?{parsed_url.query}"
         return safe_path
 
-    return default_url
+    return None
+
+
+def _get_safe_redirect_target(target_url, default_endpoint='index'):
+    """Return safe in-app redirect path, rejecting external URLs."""
+    safe_path = _local_redirect_path(target_url) if target_url else None
+    return safe_path or url_for(default_endpoint)
 
 
 def _prepare_calendar_authorization(return_url=None):
@@ -358,40 +530,64 @@ def _login_attempt_key(username):
 
 
 def _prune_login_attempts(attempts, now):
-    """Drop login attempts outside rate-limit window."""
+    """Drop login attempts outside rate-limit window. Callers hold _LOGIN_ATTEMPTS_LOCK."""
+    window_start = now - timedelta(minutes=LOGIN_RATE_LIMIT_WINDOW_MINUTES)
+    while attempts and attempts[0] < window_start:
+        attempts.popleft()
+    return attempts
+
+
+def _sweep_login_attempts(now):
+    """Forget identifiers with no attempts left in the window, at most once per sweep interval.
+
+    Callers hold _LOGIN_ATTEMPTS_LOCK.
+    """
+    global _LAST_LOGIN_ATTEMPTS_SWEEP
+
+    if time.monotonic() - _LAST_LOGIN_ATTEMPTS_SWEEP < LOGIN_ATTEMPTS_SWEEP_SECONDS:
+        return
+    _LAST_LOGIN_ATTEMPTS_SWEEP = time.monotonic()
+
     window_start = now - timedelta(minutes=LOGIN_RATE_LIMIT_WINDOW_MINUTES)
-    return [attempt_time for attempt_time in attempts if attempt_time >= window_start]
+    for key, attempts in list(LOGIN_ATTEMPTS.items()):
+        if not attempts or attempts[-1] < window_start:
+            LOGIN_ATTEMPTS.pop(key, None)
 
 
-def _get_login_rate_limit_status(username):
-    """Return rate-limit status for a login identifier."""
+def _get_login_rate_limit_status(key):
+    """Return rate-limit status for a login attempt key."""
     now = datetime.now()
-    key = _login_attempt_key(username)
-    attempts = _prune_login_attempts(LOGIN_ATTEMPTS.get(key, []), now)
-    LOGIN_ATTEMPTS[key] = attempts
+    with _LOGIN_ATTEMPTS_LOCK:
+        _sweep_login_attempts(now)
 
-    if len(attempts) < MAX_LOGIN_ATTEMPTS:
-        return False, 0
+        attempts = LOGIN_ATTEMPTS.get(key)
+        if not attempts or len(_prune_login_attempts(attempts, now)) < MAX_LOGIN_ATTEMPTS:
+            return False, 0
 
-    oldest_attempt = attempts[0]
+        oldest_attempt = attempts[0]
     retry_after = timedelta(minutes=LOGIN_RATE_LIMIT_WINDOW_MINUTES) - (now - oldest_attempt)
     retry_after_seconds = max(1, int(retry_after.total_seconds()))
     return True, retry_after_seconds
 
 
-def _record_failed_login_attempt(username):
+def _record_failed_login_attempt(key):
     """Record a failed login attempt for rate limiting."""
-    key = _login_attempt_key(username)
     now = datetime.now()
-    attempts = _prune_login_attempts(LOGIN_ATTEMPTS.get(key, []), now)
-    attempts.append(now)
-    LOGIN_ATTEMPTS[key] = attempts
+    with _LOGIN_ATTEMPTS_LOCK:
+        _sweep_login_attempts(now)
+
+        # Only the most recent MAX_LOGIN_ATTEMPTS matter for the limit
+        attempts = LOGIN_ATTEMPTS.get(key)
+        if attempts is None:
+            attempts = LOGIN_ATTEMPTS[key] = deque(maxlen=MAX_LOGIN_ATTEMPTS)
+        _prune_login_attempts(attempts, now)
+        attempts.append(now)
 
 
-def _clear_failed_login_attempts(username):
+def _clear_failed_login_attempts(key):
     """Clear failed login attempts after successful login."""
-    key = _login_attempt_key(username)
-    LOGIN_ATTEMPTS.pop(key, None)
+    with _LOGIN_ATTEMPTS_LOCK:
+        LOGIN_ATTEMPTS.pop(key, None)
 
 
 @app.cli.command('create-user')
@@ -423,32 +619,218 @@ def reset_password_command(username):
     click.echo(f"Password updated for '{username}'.")
 
 
+@app.cli.command('argon2-calibrate')
+@click.option('--target-ms', default=250, show_default=True, type=click.IntRange(min=1),
+              help='Desired time to hash one password, in milliseconds.')
+def argon2_calibrate_command(target_ms):
+    """Suggest an Argon2 time cost that hashes a password in about the target time."""
+    memory_kib = PASSWORD_HASHER.memory_cost
+    parallelism = PASSWORD_HASHER.parallelism
+
+    # Raise the time cost at the configured memory and parallelism until the target is reached
+    time_cost = 0
+    elapsed_ms = 0.0
+    while elapsed_ms < target_ms and time_cost < 50:
+        time_cost += 1
+        hasher = PasswordHasher(time_cost=time_cost, memory_cost=memory_kib, parallelism=parallelism)
+        started = time.perf_counter()
+        hasher.hash('x' * 12)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+    click.echo(f'Hashing took {elapsed_ms:.0f} ms with these settings:')
+    click.echo(f'ARGON2_TIME_COST={time_cost}')
+    click.echo(f'ARGON2_MEMORY_KIB={memory_kib}')
+    click.echo(f'ARGON2_PARALLELISM={parallelism}')
+
+
+# Parsed JSON stores keyed by file path; entries are reused until the file changes on disk
+_JSON_CACHE = {}
+
+# Serialize each store's load-modify-save cycle; gunicorn's gthread workers handle requests concurrently
+_RECIPES_LOCK = threading.Lock()
+_MEAL_PLANS_LOCK = threading.Lock()
+_USERS_LOCK = threading.Lock()
+
+
+def _file_signature(path):
+    """Return a stat-based signature for a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _load_json_store(path):
+    """Load a JSON list store, reusing the cached parse while the file is unchanged."""
+    signature = _file_signature(path)
+    if signature is None:
+        _JSON_CACHE.pop(path, None)
+        return []
+
+    entry = _JSON_CACHE.get(path)
+    if entry and entry['signature'] == signature:
+        return entry['data']
+
+    with open(path, 'rb') as f:
+        data = orjson.loads(f.read())
+
+    _JSON_CACHE[path] = {'signature': signature, 'data': data}
+    return data
+
+
+# Reading the umask means setting it, so do it once at import, before any worker threads start
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+_NEW_FILE_MODE = 0o666 & ~_UMASK
+
+
+def _write_json_atomically(path, document):
+    """Write a JSON document so readers never see a partially written file."""
+    payload = orjson.dumps(document, option=orjson.OPT_INDENT_2 if DEBUG_JSON else None)
+
+    # Write beside the target so os.replace never exposes a half-written file
+    tmp = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='.tmp-',
+                                      suffix='.json', delete=False)
+    try:
+        with tmp:
+            tmp.write(payload)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        # NamedTemporaryFile creates 0600 files; keep the permissions of the file being replaced,
+        # or give new files the umask-based mode open() would
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = _NEW_FILE_MODE
+        os.chmod(tmp.name, mode)
+        os.replace(tmp.name, path)
+    except Exception:
+        os.unlink(tmp.name)
+        raise
+
+
+def _save_json_store(path, data):
+    """Atomically write a JSON list store and refresh its cache entry."""
+    try:
+        _write_json_atomically(path, data)
+    except Exception:
+        # Callers edit the cached list in place; forget it so reads go back to the file
+        _JSON_CACHE.pop(path, None)
+        raise
+    _JSON_CACHE[path] = {'signature': _file_signature(path), 'data': data}
+
+
+def _get_store_index(path, name, builder, loader=None):
+    """Return a derived index for a JSON store, rebuilt only when the store changes."""
+    data = loader() if loader else _load_json_store(path)
+    entry = _JSON_CACHE.get(path)
+    # A concurrent save may have replaced the entry since data was loaded; never attach a stale index to it
+    if entry is None or entry['data'] is not data:
+        return builder(data)
+
+    indexes = entry.setdefault('indexes', {})
+    if name not in indexes:
+        indexes[name] = builder(data)
+    return indexes[name]
+
+
+def _max_record_id(items):
+    """Return the largest record ID in a store, or 0 when it is empty."""
+    return max((item.get('id', 0) for item in items), default=0)
+
+
+def _next_record_id(path, loader=None):
+    """Return the ID for a new record, using the max-ID tracked with the cached store.
+
+    Callers must hold the store's lock until the record is saved and passed to _record_new_id().
+    """
+    return _get_store_index(path, 'max_id', _max_record_id, loader=loader) + 1
+
+
+def _record_new_id(path, record_id):
+    """Seed a just-saved store's max-ID with the inserted ID so the next insert skips the scan."""
+    entry = _JSON_CACHE.get(path)
+    if entry is not None:
+        entry.setdefault('indexes', {})['max_id'] = record_id
+
+
+def _index_by_id(items):
+    """Map record IDs to records, keeping the first record for duplicate IDs."""
+    index = {}
+    for item in items:
+        item_id = item.get('id')
+        if item_id is not None:
+            index.setdefault(item_id, item)
+    return index
+
+
 def load_recipes():
-    """Load recipes from JSON file."""
-    if os.path.exists(RECIPES_FILE):
-        with open(RECIPES_FILE, 'r') as f:
-            return json.load(f)
-    return []
+    """Load recipes from JSON file.
+
+    The returned list is shared with the in-memory cache; callers that modify it
+    must persist the change with save_recipes().
+    """
+    return _load_json_store(RECIPES_FILE)
 
 
 def save_recipes(recipes):
     """Save recipes to JSON file."""
-    with open(RECIPES_FILE, 'w') as f:
-        json.dump(recipes, f, indent=2)
+    _save_json_store(RECIPES_FILE, recipes)
 
 
 def load_meal_plans():
-    """Load meal plans from JSON file."""
-    if os.path.exists(MEAL_PLANS_FILE):
-        with open(MEAL_PLANS_FILE, 'r') as f:
-            return json.load(f)
-    return []
+    """Load meal plans from JSON file.
+
+    The returned list is shared with the in-memory cache; callers that modify it
+    must persist the change with save_meal_plans().
+    """
+    return _load_json_store(MEAL_PLANS_FILE)
 
 
 def save_meal_plans(meal_plans):
     """Save meal plans to JSON file."""
-    with open(MEAL_PLANS_FILE, 'w') as f:
-        json.dump(meal_plans, f, indent=2)
+    _save_json_store(MEAL_PLANS_FILE, meal_plans)
+
+
+def get_recipe_by_id(recipe_id):
+    """Return the saved recipe with the given ID, or None."""
+    return _get_store_index(RECIPES_FILE, 'by_id', _index_by_id).get(recipe_id)
+
+
+def get_meal_plan_by_id(plan_id):
+    """Return the meal plan with the given ID, or None."""
+    return _get_store_index(MEAL_PLANS_FILE, 'by_id', _index_by_id).get(plan_id)
+
+
+def _sort_newest_first(meal_plans):
+    """Return meal plans ordered by creation time, newest first."""
+    return sorted(meal_plans, key=lambda x: x.get('created_at', ''), reverse=True)
+
+
+def load_meal_plans_newest_first():
+    """Load meal plans newest first, sorted once per change to the meal plans file."""
+    return _get_store_index(MEAL_PLANS_FILE, 'newest_first', _sort_newest_first)
+
+
+def _filter_main_dishes(recipes):
+    """Return the recipes whose category is a main dish."""
+    return [r for r in recipes if r.get('category') in MAIN_DISH_CATEGORIES]
+
+
+def load_main_dishes():
+    """Load saved main dish recipes, filtered once per change to the recipes file."""
+    return _get_store_index(RECIPES_FILE, 'main_dishes', _filter_main_dishes)
+
+
+def _index_main_dish_keys(recipes):
+    """Return (recipe, ID, normalized name) tuples for each main dish recipe."""
+    return [(r, r.get('id'), (r.get('name') or '').strip().lower()) for r in _filter_main_dishes(recipes)]
+
+
+def load_main_dish_keys():
+    """Load main dishes with the keys used to match recent plans, built once per recipes file change."""
+    return _get_store_index(RECIPES_FILE, 'main_dish_keys', _index_main_dish_keys)
 
 
 def create_custom_meal_entry(name):
@@ -472,21 +854,92 @@ def can_view_recipe_details(recipe):
     return bool(recipe and recipe.get('id') is not None and not recipe.get('is_custom'))
 
 
-def get_ai_client():
-    """Create and return an AI client based on the configured provider."""
+# Process-wide AI client, rebuilt only when the provider configuration changes
+_AI_CLIENT = None
+_AI_CLIENT_CONFIG = None
+_AI_CLIENT_LOCK = threading.Lock()
+
+# Recent AI selections keyed by (provider, model, prompt), oldest first
+_AI_ORDER_CACHE = OrderedDict()
+# Request threads and AI_EXECUTOR workers both read and update the cache
+_AI_ORDER_CACHE_LOCK = threading.Lock()
+
+
+def _get_cached_ai_order(cache_key):
+    """Return cached recipe indices for an AI prompt, or None."""
+    with _AI_ORDER_CACHE_LOCK:
+        indices = _AI_ORDER_CACHE.get(cache_key)
+        if indices is not None:
+            _AI_ORDER_CACHE.move_to_end(cache_key)
+    return indices
+
+
+def _cache_ai_order(cache_key, indices):
+    """Remember a validated AI selection, evicting the least recently used entries."""
+    if AI_ORDER_CACHE_SIZE <= 0:
+        return
+
+    with _AI_ORDER_CACHE_LOCK:
+        _AI_ORDER_CACHE[cache_key] = tuple(indices)
+        _AI_ORDER_CACHE.move_to_end(cache_key)
+        while len(_AI_ORDER_CACHE) > AI_ORDER_CACHE_SIZE:
+            _AI_ORDER_CACHE.popitem(last=False)
+
+
+def _create_ai_client():
+    """Create an AI client based on the configured provider."""
+    # Provider SDKs are imported on first use so startup only pays for the one in use
     if AI_PROVIDER == 'gemini':
         # Configure and return Gemini client
+        from google import genai
         return genai.Client(api_key=GOOGLE_API_KEY)
     else:
-        # Return OpenAI-compatible client (default)
+        # Return OpenAI-compatible client (default) with a keep-alive connection pool
+        import httpx
+        from openai import OpenAI
         return OpenAI(
             base_url=AI_BASE_URL,
-            api_key=AI_API_KEY
+            api_key=AI_API_KEY,
+            http_client=httpx.Client(
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+                timeout=AI_TIMEOUT_SECONDS
+            )
         )
 
 
+def get_ai_client():
+    """Return a shared AI client so connections and TLS sessions are reused across requests."""
+    global _AI_CLIENT, _AI_CLIENT_CONFIG
+
+    client_config = (AI_PROVIDER, AI_BASE_URL, AI_API_KEY, GOOGLE_API_KEY)
+    with _AI_CLIENT_LOCK:
+        if _AI_CLIENT is None or _AI_CLIENT_CONFIG != client_config:
+            _AI_CLIENT = _create_ai_client()
+            _AI_CLIENT_CONFIG = client_config
+        return _AI_CLIENT
+
+
+AI_SYSTEM_PROMPT = "You are a helpful meal planning assistant. Always respond with valid JSON only."
+# Recipe descriptions are cut to this length in AI prompts
+AI_DESCRIPTION_MAX_CHARS = 80
+# A (possibly unterminated) JSON array of recipe numbers inside an AI response
+AI_INDEX_ARRAY_RE = re.compile(r'\[\s*\d+(?:\s*,\s*\d+)*')
+
+
+# Weekday names indexed by date.weekday(), avoiding a strftime call per day
+DAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
 # Main dish categories to include in meal planning
-MAIN_DISH_CATEGORIES = {'Beef', 'Chicken', 'Pork', 'Pasta', 'Pizza', 'Beans', 'Vegetable', 'Sandwich', 'Soup'}
+MAIN_DISH_CATEGORIES = frozenset({'Beef', 'Chicken', 'Pork', 'Pasta', 'Pizza', 'Beans', 'Vegetable', 'Sandwich', 'Soup'})
+
+
+def _parse_iso_date(value):
+    """Parse a YYYY-MM-DD string (optionally datetime-prefixed) into a date."""
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        # Older plans may carry dates without zero padding
+        return datetime.strptime(value, '%Y-%m-%d').date()
 
 
 def _parse_plan_start_date(plan):
@@ -494,12 +947,9 @@ def _parse_plan_start_date(plan):
     start_date = plan.get('start_date')
     if start_date:
         try:
-            return datetime.strptime(start_date, '%Y-%m-%d').date()
+            return _parse_iso_date(start_date)
         except ValueError:
-            try:
-                return datetime.fromisoformat(start_date).date()
-            except ValueError:
-                pass
+            pass
 
     created_at = plan.get('created_at')
     if created_at:
@@ -511,12 +961,10 @@ def _parse_plan_start_date(plan):
     return None
 
 
-def _recipes_used_in_recent_plans(meal_plans, reference_start_date, lookback_days=14):
-    """Return recipe keys used in plans that overlap the lookback window before a plan start date."""
-    window_start = reference_start_date - timedelta(days=lookback_days)
-    window_end = reference_start_date - timedelta(days=1)
-
-    used_recipe_keys = set()
+def _index_plan_date_ranges(meal_plans):
+    """Return dated plans as (start, end, plan) tuples sorted by start, plus the longest span."""
+    date_ranges = []
+    longest_span = timedelta(0)
 
     for plan in meal_plans:
         plan_start = _parse_plan_start_date(plan)
@@ -527,23 +975,70 @@ def _recipes_used_in_recent_plans(meal_plans, reference_start_date, lookback_day
         if plan_days <= 0:
             continue
 
-        plan_end = plan_start + timedelta(days=plan_days - 1)
+        span = timedelta(days=plan_days - 1)
+        longest_span = max(longest_span, span)
+        date_ranges.append((plan_start, plan_start + span, plan))
+
+    date_ranges.sort(key=itemgetter(0))
+    return date_ranges, longest_span
+
+
+def load_plan_date_ranges():
+    """Load dated meal plan ranges, parsed once per change to the meal plans file."""
+    return _get_store_index(MEAL_PLANS_FILE, 'date_ranges', _index_plan_date_ranges)
+
+
+def _recipes_used_in_recent_plans(plan_date_ranges, reference_start_date, lookback_days=14):
+    """Return (recipe IDs, lowercase names) used in plans overlapping the lookback window before a start date."""
+    date_ranges, longest_span = plan_date_ranges
+    window_start = reference_start_date - timedelta(days=lookback_days)
+    window_end = reference_start_date - timedelta(days=1)
+
+    used_ids = set()
+    used_names = set()
 
-        if plan_end < window_start or plan_start > window_end:
+    # Walk back from the last plan starting inside the window until no older plan can reach it
+    for i in range(bisect_right(date_ranges, window_end, key=itemgetter(0)) - 1, -1, -1):
+        plan_start, plan_end, plan = date_ranges[i]
+        if plan_start + longest_span < window_start:
+            break
+        if plan_end < window_start:
             continue
 
         for recipe in plan.get('recipes', []):
             recipe_id = recipe.get('id')
             if recipe_id is not None:
-                used_recipe_keys.add(('id', recipe_id))
+                used_ids.add(recipe_id)
 
             recipe_name = (recipe.get('name') or '').strip().lower()
             if recipe_name:
-                used_recipe_keys.add(('name', recipe_name))
+                used_names.add(recipe_name)
+
+    return used_ids, used_names
+
+# Recipe pools at least this large are sampled in a single pass
+LARGE_RECIPE_POOL_SIZE = 64
+
+# Weight multiplier applied per recent use, by weeks ago (covers the 4-plan lookback)
+RECENCY_PENALTIES = {weeks_ago: 0.3 ** (1.0 / weeks_ago) for weeks_ago in range(1, 9)}
+
+
+def _weighted_sample_without_replacement(items, weights, count):
+    """
+    Draw weighted picks without replacement in one pass (Efraimidis-Spirakis).
+
+    Each item gets the key log(u) / weight for a uniform u in (0, 1]; taking the
+    largest keys is equivalent to drawing items one at a time by weight.
+    """
+    keyed_items = []
+    for position, (item, weight) in enumerate(zip(items, weights)):
+        key = log(1.0 - random.random()) / weight if weight > 0 else float('-inf')
+        keyed_items.append((key, position, item))
+
+    return [item for _, _, item in heapq.nlargest(count, keyed_items)]
 
-    return used_recipe_keys
 
-def select_recipes_for_week(all_recipes, previous_recipes=None, days=7):
+def select_recipes_for_week(all_recipes, previous_recipes=None, days=7, main_dishes_only=False):
     """
     Select recipes for the week with spacing to avoid repetition.
     Only selects main dishes (excludes desserts, beverages, breads, sauces, appetizers, etc.).
@@ -552,59 +1047,99 @@ def select_recipes_for_week(all_recipes, previous_recipes=None, days=7):
         all_recipes: List of all available recipes
         previous_recipes: List of recipes used in recent weeks
         days: Number of days to plan for
+        main_dishes_only: True if all_recipes is already filtered to main dishes
 
     Returns:
         List of selected recipes
     """
     # Filter to only main dishes
-    main_dishes = [r for r in all_recipes if r.get('category', '') in MAIN_DISH_CATEGORIES]
+    main_dishes = all_recipes if main_dishes_only else _filter_main_dishes(all_recipes)
 
     if not main_dishes:
         return []
 
-    # Create a weighted list based on recency
-    recipe_weights = {}
-    for recipe in main_dishes:
-        recipe_id = recipe.get('id', recipe.get('name'))
-        # Default weight
-        recipe_weights[recipe_id] = 1.0
-
-        # Reduce weight if recipe was used recently
-        if previous_recipes:
-            for i, prev_recipe in enumerate(previous_recipes):
-                prev_id = prev_recipe.get('id', prev_recipe.get('name'))
-                if prev_id == recipe_id:
-                    # More recent = lower weight
-                    weeks_ago = i // 7 + 1
-                    recipe_weights[recipe_id] *= (0.3 ** (1.0 / weeks_ago))
+    # Combine recency penalties for each previously used recipe in one pass
+    recency_multipliers = {}
+    for i, prev_recipe in enumerate(previous_recipes or []):
+        prev_id = prev_recipe.get('id', prev_recipe.get('name'))
+        # More recent = lower weight
+        weeks_ago = i // 7 + 1
+        penalty = RECENCY_PENALTIES.get(weeks_ago)
+        if penalty is None:
+            penalty = 0.3 ** (1.0 / weeks_ago)
+        recency_multipliers[prev_id] = recency_multipliers.get(prev_id, 1.0) * penalty
+
+    # Weights stay aligned with available_recipes as picks are removed
+    available_recipes = main_dishes.copy()
+    weights = [recency_multipliers.get(r.get('id', r.get('name')), 1.0) for r in available_recipes]
+
+    pick_count = min(days, len(main_dishes))
+    if pick_count == len(available_recipes) and not recency_multipliers:
+        # Every recipe is used and all weights are equal, so only the day order is random
+        random.shuffle(available_recipes)
+        return available_recipes
+    if len(available_recipes) >= LARGE_RECIPE_POOL_SIZE:
+        return _weighted_sample_without_replacement(available_recipes, weights, pick_count)
 
     # Select recipes for the week (no duplicates within a week)
     selected = []
-    available_recipes = main_dishes.copy()
 
-    for _ in range(min(days, len(main_dishes))):
+    for _ in range(pick_count):
         if not available_recipes:
             break
 
-        # Calculate weights for remaining recipes
-        weights = [recipe_weights.get(r.get('id', r.get('name')), 1.0)
-                  for r in available_recipes]
-
-        # Select a recipe using weighted random choice
-        total_weight = sum(weights)
-        if total_weight == 0:
-            selected_recipe = random.choice(available_recipes)
+        # Select a recipe using weighted random choice over cumulative weights
+        cumulative_weights = list(accumulate(weights))
+        total_weight = cumulative_weights[-1]
+        if total_weight <= 0:
+            index = random.randrange(len(available_recipes))
         else:
-            normalized_weights = [w / total_weight for w in weights]
-            selected_recipe = random.choices(available_recipes, weights=normalized_weights)[0]
+            target = random.random() * total_weight
+            index = min(bisect_right(cumulative_weights, target), len(available_recipes) - 1)
+
+        selected.append(available_recipes[index])
 
-        selected.append(selected_recipe)
-        available_recipes.remove(selected_recipe)
+        # Swap-pop removal keeps each removal O(1)
+        available_recipes[index] = available_recipes[-1]
+        available_recipes.pop()
+        weights[index] = weights[-1]
+        weights.pop()
 
     return selected
 
 
-def generate_meal_plan_with_ai(recipes, days=None, recent_recipes=None):
+def _read_streamed_array(chunks, stream=None):
+    """Accumulate streamed text, stopping once a complete JSON array has arrived."""
+    parts = []
+    for text in chunks:
+        if not text:
+            continue
+        parts.append(text)
+        if ']' in text:
+            buffered = ''.join(parts)
+            start = buffered.find('[')
+            if start != -1 and ']' in buffered[start:]:
+                break
+
+    # Stop the provider from decoding tokens we no longer need
+    response = getattr(stream, 'response', None)
+    close = getattr(stream, 'close', None) or getattr(response, 'close', None)
+    if close:
+        close()
+
+    return ''.join(parts)
+
+
+def _describe_recipe_for_prompt(number, recipe):
+    """Return the numbered prompt line for a candidate recipe."""
+    # Short descriptions keep the prompt small; the name and category carry most of the signal
+    category = recipe.get('category', 'Uncategorized')
+    description = (recipe.get('description') or '').strip()[:AI_DESCRIPTION_MAX_CHARS]
+    line = f"{number}. {recipe['name']} ({category})"
+    return f"{line}: {description}" if description else line
+
+
+def generate_meal_plan_with_ai(recipes, days=None, recent_recipes=None, fallback=True):
     """
     Use AI to select and order recipes for a meal plan.
 
@@ -612,27 +1147,29 @@ def generate_meal_plan_with_ai(recipes, days=None, recent_recipes=None):
         recipes: Candidate recipes available for selection
         days: Number of recipes needed in the meal plan
         recent_recipes: Recipes used in recent plans for variety context
+        fallback: Return the first candidates in order when the AI gives no usable answer;
+            pass False to get None instead
 
     Returns:
-        List of selected recipes in suggested order
+        List of selected recipes in suggested order, or None when fallback is False
+        and the AI was skipped, failed or returned no usable selection
     """
     if not recipes:
         return []
 
     requested_days = int(days) if days is not None else len(recipes)
     target_count = min(max(requested_days, 0), len(recipes))
-    fallback_recipes = recipes[:target_count]
+    fallback_recipes = recipes[:target_count] if fallback else None
 
-    try:
-        client = get_ai_client()
+    # Too few candidates for a meaningful choice; avoid the network call
+    if target_count == 0 or len(recipes) < AI_REORDER_MIN_RECIPES:
+        return fallback_recipes
 
+    try:
         # Prepare recipe descriptions
-        recipe_descriptions = []
-        for i, recipe in enumerate(recipes):
-            category = recipe.get('category', 'Uncategorized')
-            recipe_descriptions.append(
-                f"{i+1}. {recipe['name']} ({category}): {recipe.get('description', 'No description')}"
-            )
+        recipe_lines = '\n'.join(
+            _describe_recipe_for_prompt(number, recipe) for number, recipe in enumerate(recipes, start=1)
+        )
 
         recent_meal_names = []
         seen_recent_names = set()
@@ -661,27 +1198,33 @@ Recent meals to avoid repeating or closely imitating:
     Consider variety, nutritional balance, and typical weekly eating patterns.{recent_context}
 
 Recipes:
-{chr(10).join(recipe_descriptions)}
+{recipe_lines}
 
     Respond with ONLY a JSON array of recipe numbers (e.g., [3, 1, 5, 2]).
 Do not include any other text or explanation."""
 
+        # Identical prompts reuse the last valid selection instead of calling the AI again
+        cache_key = (AI_PROVIDER, AI_MODEL, prompt)
+        cached_indices = _get_cached_ai_order(cache_key)
+        if cached_indices is not None:
+            return [recipes[idx - 1] for idx in cached_indices]
+
+        client = get_ai_client()
+
         if AI_PROVIDER == 'gemini':
             # Use Gemini API
-            full_prompt = "You are a helpful meal planning assistant. Always respond with valid JSON only.\n\n" + prompt
-            response = client.models.generate_content(
+            from google.genai import types as genai_types
+
+            stream = client.models.generate_content_stream(
                 model=AI_MODEL,
-                contents=full_prompt,
-                config=genai.types.GenerateContentConfig(
+                contents=prompt,
+                config=genai_types.GenerateContentConfig(
+                    system_instruction=AI_SYSTEM_PROMPT,
                     temperature=0.7,
                     max_output_tokens=500,
                 )
             )
-
-            # Check finish reason and safety ratings
-            print(f"Gemini finish reason: {response.candidates[0].finish_reason if response.candidates else 'No candidates'}")
-
-            result = response.text.strip()
+            result = _read_streamed_array((chunk.text for chunk in stream), stream).strip()
 
             # Remove markdown code blocks if present
             if result.startswith('```'):
@@ -693,41 +1236,43 @@ Do not include any other text or explanation."""
                 result = result.strip()
         else:
             # Use OpenAI-compatible API
-            response = client.chat.completions.create(
+            # A JSON array of indices needs only a few tokens per recipe
+            stream = client.chat.completions.create(
                 model=AI_MODEL,
                 messages=[
-                    {"role": "system", "content": "You are a helpful meal planning assistant. Always respond with valid JSON only."},
+                    {"role": "system", "content": AI_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.7,
-                max_tokens=200
+                max_tokens=max(64, 4 * target_count + 16),
+                stream=True
             )
-            result = response.choices[0].message.content.strip()
+            result = _read_streamed_array(
+                (chunk.choices[0].delta.content if chunk.choices else None for chunk in stream),
+                stream
+            ).strip()
 
         # Check if we got a valid response
         if not result:
             print("AI returned empty response")
             return fallback_recipes
 
-        # Parse the JSON response
+        # Parse the JSON response; only clean, complete answers are cached
+        recovered = False
         try:
             order = json.loads(result)
         except json.JSONDecodeError as json_err:
             print(f"Failed to parse AI response as JSON: {json_err}")
             print(f"Full response: {result}")
 
-            # Try to fix incomplete JSON array
-            if result.startswith('[') and not result.endswith(']'):
-                print("Attempting to fix incomplete JSON array...")
-                result = result.rstrip(',') + ']'
-                try:
-                    order = json.loads(result)
-                    print("Successfully fixed incomplete JSON")
-                except:
-                    print("Could not fix JSON, using fallback")
-                    return fallback_recipes
-            else:
+            # Recover an index array wrapped in prose or cut off before its closing bracket
+            match = AI_INDEX_ARRAY_RE.search(result)
+            if not match:
+                print("Could not find a JSON array, using fallback")
                 return fallback_recipes
+            order = [int(idx) for idx in match.group(0)[1:].split(',')]
+            recovered = True
+            print("Recovered recipe numbers from partial JSON")
 
         if not isinstance(order, list):
             return fallback_recipes
@@ -745,14 +1290,18 @@ Do not include any other text or explanation."""
                 break
 
         # Fill with remaining candidates if AI returned too few valid choices
-        if len(selected_indices) < target_count:
+        complete = len(selected_indices) >= target_count
+        if not complete:
             for idx in range(1, len(recipes) + 1):
                 if idx not in seen_indices:
                     selected_indices.append(idx)
                     if len(selected_indices) >= target_count:
                         break
 
-        return [recipes[idx - 1] for idx in selected_indices[:target_count]]
+        selected_indices = selected_indices[:target_count]
+        if complete and not recovered:
+            _cache_ai_order(cache_key, selected_indices)
+        return [recipes[idx - 1] for idx in selected_indices]
 
     except Exception as e:
         print(f"AI meal plan generation failed: {e}")
@@ -760,6 +1309,41 @@ Do not include any other text or explanation."""
         return fallback_recipes
 
 
+def _is_ai_selection_pending(plan):
+    """Return True while a background AI selection may still update a plan."""
+    if not plan.get('ai_pending'):
+        return False
+
+    try:
+        created_at = datetime.fromisoformat(plan.get('created_at', ''))
+    except ValueError:
+        return False
+
+    return datetime.now() - created_at < timedelta(seconds=AI_BACKGROUND_TIMEOUT_SECONDS)
+
+
+def _complete_ai_selection(plan_id, candidates, days, recent_recipes):
+    """Apply an AI selection to a staged plan unless the user has already changed it."""
+    # Without a usable AI answer the staged weighted selection beats candidate file order
+    selected_recipes = generate_meal_plan_with_ai(candidates, days=days, recent_recipes=recent_recipes,
+                                                  fallback=False)
+
+    # Every meal plan writer holds this lock, so the checks below see the latest saved plan
+    with _MEAL_PLANS_LOCK:
+        meal_plans = load_meal_plans()
+        plan = get_meal_plan_by_id(plan_id)
+        # Deleted, swapped and accepted plans are left alone
+        if not plan or not plan.get('ai_pending') or plan.get('status') != 'staged':
+            return
+
+        plan['ai_pending'] = False
+        if selected_recipes:
+            plan['recipes'] = selected_recipes
+            plan['grocery_list'] = generate_grocery_list(selected_recipes)
+
+        save_meal_plans(meal_plans)
+
+
 def generate_grocery_list(recipes):
     """
     Generate a grocery list from recipes, aggregating quantities.
@@ -770,38 +1354,31 @@ def generate_grocery_list(recipes):
     Returns:
         Dictionary of ingredients with aggregated quantities
     """
-    grocery_list = defaultdict(lambda: {"quantity": 0, "unit": "", "original": []})
+    # Quantities are only added together when the units match; each entry is [quantity, recipe names]
+    totals = {}
 
     for recipe in recipes:
-        ingredients = recipe.get('ingredients', [])
-        for ingredient in ingredients:
+        recipe_name = recipe['name']
+        for ingredient in recipe.get('ingredients', []):
             item_name = ingredient.get('item', '').lower()
-            quantity = ingredient.get('quantity', 0)
-            unit = ingredient.get('unit', '')
-
-            if item_name:
-                # Store original entries for reference
-                grocery_list[item_name]['original'].append({
-                    'quantity': quantity,
-                    'unit': unit,
-                    'recipe': recipe['name']
-                })
+            if not item_name:
+                continue
 
-                # Aggregate quantities (simple addition, assumes same units)
-                if isinstance(quantity, (int, float)):
-                    grocery_list[item_name]['quantity'] += quantity
-                    if not grocery_list[item_name]['unit'] and unit:
-                        grocery_list[item_name]['unit'] = unit
+            key = (item_name, ingredient.get('unit') or '')
+            entry = totals.get(key)
+            if entry is None:
+                entry = totals[key] = [0, []]
+            entry[1].append(recipe_name)
+
+            quantity = ingredient.get('quantity', 0)
+            if type(quantity) in (int, float):
+                entry[0] += quantity
 
     # Convert to list format
-    result = []
-    for item_name, data in sorted(grocery_list.items()):
-        result.append({
-            'item': item_name,
-            'quantity': data['quantity'],
-            'unit': data['unit'],
-            'recipes': [entry['recipe'] for entry in data['original']]
-        })
+    result = [
+        {'item': item_name, 'quantity': quantity, 'unit': unit, 'recipes': recipe_names}
+        for (item_name, unit), (quantity, recipe_names) in sorted(totals.items())
+    ]
 
     return result
 
@@ -819,7 +1396,9 @@ def login():
         username = (request.form.get('username') or '').strip()
         password = request.form.get('password') or ''
 
-        is_rate_limited, retry_after_seconds = _get_login_rate_limit_status(username)
+        # Resolve the client and username key once for every rate-limit step below
+        attempt_key = _login_attempt_key(username)
+        is_rate_limited, retry_after_seconds = _get_login_rate_limit_status(attempt_key)
         if is_rate_limited:
             retry_after_minutes = max(1, retry_after_seconds // 60)
             error = f'Too many failed login attempts. Try again in {retry_after_minutes} minute(s).'
@@ -834,10 +1413,10 @@ def login():
             session['username'] = user['username']
             session['user_id'] = user.get('id')
             session['csrf_token'] = secrets.token_urlsafe(32)
-            _clear_failed_login_attempts(username)
+            _clear_failed_login_attempts(attempt_key)
             return redirect(next_url)
 
-        _record_failed_login_attempt(username)
+        _record_failed_login_attempt(attempt_key)
         error = 'Invalid username or password.'
 
     return render_template('login.html', error=error, next_url=next_url)
@@ -902,16 +1481,19 @@ def recipes():
 def add_recipe():
     """Add a new recipe."""
     if request.method == 'POST':
-        data = request.json
-        recipes = load_recipes()
+        data = request.get_json()
+
+        with _RECIPES_LOCK:
+            recipes = load_recipes()
 
-        # Generate ID
-        recipe_id = max([r.get('id', 0) for r in recipes], default=0) + 1
-        data['id'] = recipe_id
-        data['created_at'] = datetime.now().isoformat()
+            # Generate ID
+            recipe_id = _next_record_id(RECIPES_FILE)
+            data['id'] = recipe_id
+            data['created_at'] = datetime.now().isoformat()
 
-        recipes.append(data)
-        save_recipes(recipes)
+            recipes.append(data)
+            save_recipes(recipes)
+            _record_new_id(RECIPES_FILE, recipe_id)
 
         return jsonify({'success': True, 'id': recipe_id})
 
@@ -921,8 +1503,7 @@ def add_recipe():
 @app.route('/recipes/<int:recipe_id>')
 def view_recipe(recipe_id):
     """View a specific recipe."""
-    recipes = load_recipes()
-    recipe = next((r for r in recipes if r.get('id') == recipe_id), None)
+    recipe = get_recipe_by_id(recipe_id)
 
     if not recipe:
         return "Recipe not found", 404
@@ -933,103 +1514,122 @@ def view_recipe(recipe_id):
 @app.route('/recipes/<int:recipe_id>/delete', methods=['POST'])
 def delete_recipe(recipe_id):
     """Delete a saved recipe."""
-    recipes = load_recipes()
-    recipe = next((r for r in recipes if r.get('id') == recipe_id), None)
+    with _RECIPES_LOCK:
+        recipes = load_recipes()
+        recipe = get_recipe_by_id(recipe_id)
 
-    if not recipe:
-        return jsonify({'error': 'Recipe not found'}), 404
+        if not recipe:
+            return jsonify({'error': 'Recipe not found'}), 404
 
-    remaining_recipes = [r for r in recipes if r.get('id') != recipe_id]
-    save_recipes(remaining_recipes)
+        remaining_recipes = [r for r in recipes if r.get('id') != recipe_id]
+        save_recipes(remaining_recipes)
 
-    return jsonify({'success': True, 'redirect': url_for('recipes')})
+        return jsonify({'success': True, 'redirect': url_for('recipes')})
 
 
 @app.route('/meal-plans')
 def meal_plans():
-    """Display all meal plans."""
-    all_plans = load_meal_plans()
-    # Sort by date, newest first
-    all_plans.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-    return render_template('meal_plans.html', meal_plans=all_plans)
+    """Display meal plans newest first, one page at a time."""
+    plans = load_meal_plans_newest_first()
+    size = min(max(1, request.args.get('size', MEAL_PLANS_PAGE_SIZE, type=int)), 100)
+    total_pages = max(1, -(-len(plans) // size))
+    page = min(max(1, request.args.get('page', 1, type=int)), total_pages)
+    start = (page - 1) * size
+    return render_template(
+        'meal_plans.html',
+        meal_plans=plans[start:start + size],
+        page=page,
+        page_size=size,
+        total_pages=total_pages
+    )
 
 
 @app.route('/meal-plans/generate', methods=['GET', 'POST'])
 def generate_meal_plan():
     """Generate a new meal plan."""
     if request.method == 'POST':
-        data = request.json
+        data = request.get_json()
         days = data.get('days', 7)
         use_ai = data.get('use_ai', True)
         start_date_str = data.get('start_date', datetime.now().strftime('%Y-%m-%d'))
 
         try:
-            plan_start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-        except ValueError:
+            plan_start_date = _parse_iso_date(start_date_str)
+        except (TypeError, ValueError):
             plan_start_date = datetime.now().date()
-            start_date_str = plan_start_date.strftime('%Y-%m-%d')
+        start_date_str = plan_start_date.isoformat()
 
         # Load recipes and previous meal plans
         all_recipes = load_recipes()
-        meal_plans = load_meal_plans()
 
         if not all_recipes:
             return jsonify({'error': 'No recipes available'}), 400
 
-        # Filter to only main dishes
-        main_dishes = [r for r in all_recipes if r.get('category', '') in MAIN_DISH_CATEGORIES]
+        # Main dishes are filtered once per change to the recipes file
+        main_dishes = load_main_dishes()
         if not main_dishes:
             return jsonify({'error': 'No main dish recipes available. Please add recipes with categories: Beef, Chicken, Pork, Pasta, Pizza, Beans, Vegetable, Sandwich, or Soup'}), 400
 
         # Exclude recipes used in plans that overlap the previous 2 weeks
-        recent_recipe_keys = _recipes_used_in_recent_plans(meal_plans, plan_start_date, lookback_days=14)
-        filtered_main_dishes = []
-        for recipe in main_dishes:
-            recipe_id = recipe.get('id')
-            recipe_name = (recipe.get('name') or '').strip().lower()
-
-            id_is_recent = recipe_id is not None and ('id', recipe_id) in recent_recipe_keys
-            name_is_recent = recipe_name and ('name', recipe_name) in recent_recipe_keys
-
-            if not id_is_recent and not name_is_recent:
-                filtered_main_dishes.append(recipe)
+        recent_ids, recent_names = _recipes_used_in_recent_plans(load_plan_date_ranges(), plan_start_date,
+                                                                 lookback_days=14)
+        # Neither set holds None or '', so recipes missing an ID or name only match on the other key
+        filtered_main_dishes = [
+            recipe for recipe, recipe_id, recipe_name in load_main_dish_keys()
+            if recipe_id not in recent_ids and recipe_name not in recent_names
+        ]
 
         if not filtered_main_dishes:
             return jsonify({'error': 'No eligible main dish recipes available after excluding meals used in the previous 2 weeks.'}), 400
 
         # Get previous recipes for spacing
-        previous_recipes = []
-        for plan in sorted(meal_plans, key=lambda x: x.get('created_at', ''), reverse=True)[:4]:
-            previous_recipes.extend(plan.get('recipes', []))
+        previous_recipes = [recipe for plan in load_meal_plans_newest_first()[:4]
+                            for recipe in plan.get('recipes', [])]
 
         # Select recipes from eligible candidates
-        if use_ai:
+        ai_pending = bool(use_ai and AI_BACKGROUND_SELECTION)
+        if ai_pending:
+            # Stage a weighted selection now; the AI replaces it when it responds
+            selected_recipes = select_recipes_for_week(filtered_main_dishes, previous_recipes, days,
+                                                       main_dishes_only=True)
+        elif use_ai:
             selected_recipes = generate_meal_plan_with_ai(
                 filtered_main_dishes,
                 days=days,
                 recent_recipes=previous_recipes
             )
         else:
-            selected_recipes = select_recipes_for_week(filtered_main_dishes, previous_recipes, days)
+            selected_recipes = select_recipes_for_week(filtered_main_dishes, previous_recipes, days,
+                                                       main_dishes_only=True)
 
         # Generate grocery list
         grocery_list = generate_grocery_list(selected_recipes)
 
-        # Create meal plan
-        meal_plan = {
-            'id': max([p.get('id', 0) for p in meal_plans], default=0) + 1,
-            'created_at': datetime.now().isoformat(),
-            'start_date': start_date_str,
-            'days': days,
-            'recipes': selected_recipes,
-            'grocery_list': grocery_list,
-            'status': 'staged',  # New plans start as staged
-            'calendar_added': False,
-            'calendar_event_ids': []
-        }
-
-        meal_plans.append(meal_plan)
-        save_meal_plans(meal_plans)
+        # Reload and allocate the ID under the lock so concurrent requests keep each other's plans
+        with _MEAL_PLANS_LOCK:
+            meal_plans = load_meal_plans()
+
+            # Create meal plan
+            meal_plan = {
+                'id': _next_record_id(MEAL_PLANS_FILE),
+                'created_at': datetime.now().isoformat(),
+                'start_date': start_date_str,
+                'days': days,
+                'recipes': selected_recipes,
+                'grocery_list': grocery_list,
+                'status': 'staged',  # New plans start as staged
+                'calendar_added': False,
+                'calendar_event_ids': [],
+                'ai_pending': ai_pending
+            }
+
+            meal_plans.append(meal_plan)
+            save_meal_plans(meal_plans)
+            _record_new_id(MEAL_PLANS_FILE, meal_plan['id'])
+
+        if ai_pending:
+            AI_EXECUTOR.submit(_complete_ai_selection, meal_plan['id'],
+                               filtered_main_dishes, days, previous_recipes)
 
         return jsonify({
             'success': True,
@@ -1041,25 +1641,34 @@ def generate_meal_plan():
     return render_template('generate_meal_plan.html', recipe_count=len(recipes))
 
 
+def _plan_day_labels(start_date_str, count):
+    """Return (day name, ISO date) pairs for consecutive days of a meal plan."""
+    start_date = _parse_iso_date(start_date_str) if start_date_str else date.today()
+    labels = []
+    for i in range(count):
+        day_date = start_date + timedelta(days=i)
+        labels.append((DAY_NAMES[day_date.weekday()], day_date.isoformat()))
+    return labels
+
+
 @app.route('/meal-plans/<int:plan_id>')
 def view_meal_plan(plan_id):
     """View a specific meal plan."""
-    meal_plans = load_meal_plans()
-    plan = next((p for p in meal_plans if p.get('id') == plan_id), None)
+    plan = get_meal_plan_by_id(plan_id)
 
     if not plan:
         return "Meal plan not found", 404
 
     # Add day names based on actual dates
-    start_date = datetime.strptime(plan.get('start_date', datetime.now().strftime('%Y-%m-%d')), '%Y-%m-%d')
+    plan_recipes = plan.get('recipes', [])
+    plan_days = _plan_day_labels(plan.get('start_date'), len(plan_recipes))
 
     recipes_with_days = []
-    for i, recipe in enumerate(plan.get('recipes', [])):
-        day_date = start_date + timedelta(days=i)
+    for recipe, (day_name, iso_date) in zip(plan_recipes, plan_days):
         recipes_with_days.append({
             'recipe': recipe,
-            'day': day_date.strftime('%A'),
-            'date': day_date.strftime('%Y-%m-%d'),
+            'day': day_name,
+            'date': iso_date,
             'can_view_recipe': can_view_recipe_details(recipe)
         })
 
@@ -1071,22 +1680,21 @@ def view_meal_plan(plan_id):
 @app.route('/meal-plans/<int:plan_id>/stage')
 def stage_meal_plan(plan_id):
     """View and edit a staged meal plan."""
-    meal_plans = load_meal_plans()
-    plan = next((p for p in meal_plans if p.get('id') == plan_id), None)
+    plan = get_meal_plan_by_id(plan_id)
 
     if not plan:
         return "Meal plan not found", 404
 
     # Add day names based on actual dates
-    start_date = datetime.strptime(plan.get('start_date', datetime.now().strftime('%Y-%m-%d')), '%Y-%m-%d')
+    plan_recipes = plan.get('recipes', [])
+    plan_days = _plan_day_labels(plan.get('start_date'), len(plan_recipes))
 
     recipes_with_days = []
-    for i, recipe in enumerate(plan.get('recipes', [])):
-        day_date = start_date + timedelta(days=i)
+    for i, (recipe, (day_name, iso_date)) in enumerate(zip(plan_recipes, plan_days)):
         recipes_with_days.append({
             'recipe': recipe,
-            'day': day_date.strftime('%A'),
-            'date': day_date.strftime('%Y-%m-%d'),
+            'day': day_name,
+            'date': iso_date,
             'day_index': i,
             'can_view_recipe': can_view_recipe_details(recipe)
         })
@@ -1098,110 +1706,127 @@ def stage_meal_plan(plan_id):
                          plan=plan,
                          recipes_with_days=recipes_with_days,
                          all_recipes=all_recipes,
-                         calendar_configured=is_calendar_configured())
+                         calendar_configured=is_calendar_configured(),
+                         ai_pending=_is_ai_selection_pending(plan))
+
+
+@app.route('/meal-plans/<int:plan_id>/ai-status')
+def meal_plan_ai_status(plan_id):
+    """Report whether a background AI selection is still pending for a plan."""
+    plan = get_meal_plan_by_id(plan_id)
+
+    if not plan:
+        return jsonify({'error': 'Meal plan not found'}), 404
+
+    return jsonify({'pending': _is_ai_selection_pending(plan)})
 
 
 @app.route('/meal-plans/<int:plan_id>/swap', methods=['POST'])
 def swap_recipe(plan_id):
     """Swap a recipe in a staged meal plan."""
-    data = request.json or {}
+    data = request.get_json() or {}
     day_index = data.get('day_index')
     new_recipe_id = data.get('new_recipe_id')
     custom_recipe_name = (data.get('custom_recipe_name') or '').strip()
 
-    meal_plans = load_meal_plans()
-    plan = next((p for p in meal_plans if p.get('id') == plan_id), None)
-
-    if not plan:
-        return jsonify({'error': 'Meal plan not found'}), 404
+    with _MEAL_PLANS_LOCK:
+        meal_plans = load_meal_plans()
+        plan = get_meal_plan_by_id(plan_id)
 
-    if plan.get('status') != 'staged':
-        return jsonify({'error': 'Can only swap recipes in staged plans'}), 400
+        if not plan:
+            return jsonify({'error': 'Meal plan not found'}), 404
 
-    try:
-        day_index = int(day_index)
-    except (TypeError, ValueError):
-        return jsonify({'error': 'Invalid day index'}), 400
+        if plan.get('status') != 'staged':
+            return jsonify({'error': 'Can only swap recipes in staged plans'}), 400
 
-    if custom_recipe_name:
-        try:
-            new_recipe = create_custom_meal_entry(custom_recipe_name)
-        except ValueError as exc:
-            return jsonify({'error': str(exc)}), 400
-    else:
         try:
-            new_recipe_id = int(new_recipe_id)
+            day_index = int(day_index)
         except (TypeError, ValueError):
-            return jsonify({'error': 'Recipe or custom meal is required'}), 400
+            return jsonify({'error': 'Invalid day index'}), 400
 
-        all_recipes = load_recipes()
-        new_recipe = next((r for r in all_recipes if r.get('id') == new_recipe_id), None)
+        if custom_recipe_name:
+            try:
+                new_recipe = create_custom_meal_entry(custom_recipe_name)
+            except ValueError as exc:
+                return jsonify({'error': str(exc)}), 400
+        else:
+            try:
+                new_recipe_id = int(new_recipe_id)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Recipe or custom meal is required'}), 400
 
-        if not new_recipe:
-            return jsonify({'error': 'Recipe not found'}), 404
+            new_recipe = get_recipe_by_id(new_recipe_id)
 
-    # Swap the recipe
-    if 0 <= day_index < len(plan['recipes']):
-        plan['recipes'][day_index] = new_recipe
+            if not new_recipe:
+                return jsonify({'error': 'Recipe not found'}), 404
 
-        # Regenerate grocery list
-        plan['grocery_list'] = generate_grocery_list(plan['recipes'])
+        # Swap the recipe
+        if 0 <= day_index < len(plan['recipes']):
+            plan['recipes'][day_index] = new_recipe
+            # Manual changes take precedence over a pending AI selection
+            plan['ai_pending'] = False
 
-        # Save changes
-        save_meal_plans(meal_plans)
+            # Regenerate grocery list
+            plan['grocery_list'] = generate_grocery_list(plan['recipes'])
 
-        return jsonify({'success': True, 'recipe': new_recipe})
+            # Save changes
+            save_meal_plans(meal_plans)
 
-    return jsonify({'error': 'Invalid day index'}), 400
+            return jsonify({'success': True, 'recipe': new_recipe})
+
+        return jsonify({'error': 'Invalid day index'}), 400
 
 
 @app.route('/meal-plans/<int:plan_id>/accept', methods=['POST'])
 def accept_meal_plan(plan_id):
     """Accept a staged meal plan and optionally add to calendar."""
-    data = request.json
+    data = request.get_json()
     add_to_calendar = data.get('add_to_calendar', False)
 
-    meal_plans = load_meal_plans()
-    plan = next((p for p in meal_plans if p.get('id') == plan_id), None)
+    with _MEAL_PLANS_LOCK:
+        meal_plans = load_meal_plans()
+        plan = get_meal_plan_by_id(plan_id)
 
-    if not plan:
-        return jsonify({'error': 'Meal plan not found'}), 404
+        if not plan:
+            return jsonify({'error': 'Meal plan not found'}), 404
 
-    if plan.get('status') != 'staged':
-        return jsonify({'error': 'Can only accept staged plans'}), 400
+        if plan.get('status') != 'staged':
+            return jsonify({'error': 'Can only accept staged plans'}), 400
+
+        # Add to Google Calendar if requested (BEFORE accepting the plan)
+        calendar_result = None
+        if add_to_calendar and is_calendar_configured():
+            calendar_result = add_meal_plan_to_calendar(plan)
+            if calendar_result.get('success'):
+                # Calendar added successfully
+                pass
+            elif 'authenticate' in calendar_result.get('error', '').lower():
+                # User needs to authorize - DON'T accept the plan yet
+                auth_url = _prepare_calendar_authorization(request.referrer)
+                if not auth_url:
+                    return jsonify({
+                        'success': False,
+                        'error': 'Could not generate authorization URL. Please ensure credentials.json is configured.'
+                    }), 500
 
-    # Add to Google Calendar if requested (BEFORE accepting the plan)
-    calendar_result = None
-    if add_to_calendar and is_calendar_configured():
-        calendar_result = add_meal_plan_to_calendar(plan)
-        if calendar_result.get('success'):
-            # Calendar added successfully
-            pass
-        elif 'authenticate' in calendar_result.get('error', '').lower():
-            # User needs to authorize - DON'T accept the plan yet
-            auth_url = _prepare_calendar_authorization(request.referrer)
-            if not auth_url:
                 return jsonify({
                     'success': False,
-                    'error': 'Could not generate authorization URL. Please ensure credentials.json is configured.'
-                }), 500
-
-            return jsonify({
-                'success': False,
-                'needs_authorization': True,
-                'authorization_url': auth_url,
-                'message': 'Please authorize Google Calendar access first'
-            })
+                    'needs_authorization': True,
+                    'authorization_url': auth_url,
+                    'message': 'Please authorize Google Calendar access first'
+                })
 
-    # Only update plan status AFTER calendar operations succeed
-    plan['status'] = 'accepted'
-    plan['accepted_at'] = datetime.now().isoformat()
+        # Only update plan status AFTER calendar operations succeed
+        plan['status'] = 'accepted'
+        plan['accepted_at'] = datetime.now().isoformat()
+        # Accepting keeps the recipes as reviewed, so a late AI selection no longer applies
+        plan['ai_pending'] = False
 
-    if calendar_result and calendar_result.get('success'):
-        plan['calendar_added'] = True
-        plan['calendar_event_ids'] = calendar_result.get('event_ids', [])
+        if calendar_result and calendar_result.get('success'):
+            plan['calendar_added'] = True
+            plan['calendar_event_ids'] = calendar_result.get('event_ids', [])
 
-    save_meal_plans(meal_plans)
+        save_meal_plans(meal_plans)
 
     response = {'success': True, 'redirect': url_for('view_meal_plan', plan_id=plan_id)}
     if calendar_result:
@@ -1213,66 +1838,68 @@ def accept_meal_plan(plan_id):
 @app.route('/meal-plans/<int:plan_id>/add-to-calendar', methods=['POST'])
 def add_plan_to_calendar(plan_id):
     """Add an accepted meal plan to Google Calendar."""
-    meal_plans = load_meal_plans()
-    plan = next((p for p in meal_plans if p.get('id') == plan_id), None)
+    with _MEAL_PLANS_LOCK:
+        meal_plans = load_meal_plans()
+        plan = get_meal_plan_by_id(plan_id)
 
-    if not plan:
-        return jsonify({'error': 'Meal plan not found'}), 404
+        if not plan:
+            return jsonify({'error': 'Meal plan not found'}), 404
 
-    if plan.get('status') not in ['accepted', 'staged']:
-        return jsonify({'error': 'Can only add accepted or staged plans to calendar'}), 400
+        if plan.get('status') not in ['accepted', 'staged']:
+            return jsonify({'error': 'Can only add accepted or staged plans to calendar'}), 400
 
-    if plan.get('calendar_added'):
-        return jsonify({'error': 'Plan is already added to calendar'}), 400
+        if plan.get('calendar_added'):
+            return jsonify({'error': 'Plan is already added to calendar'}), 400
 
-    if not is_calendar_configured():
-        return jsonify({'error': 'Google Calendar is not configured'}), 400
+        if not is_calendar_configured():
+            return jsonify({'error': 'Google Calendar is not configured'}), 400
 
-    # Attempt to add to calendar
-    calendar_result = add_meal_plan_to_calendar(plan)
+        # Attempt to add to calendar
+        calendar_result = add_meal_plan_to_calendar(plan)
 
-    if calendar_result.get('success'):
-        plan['calendar_added'] = True
-        plan['calendar_event_ids'] = calendar_result.get('event_ids', [])
-        save_meal_plans(meal_plans)
-        return jsonify({
-            'success': True,
-            'message': calendar_result.get('message', 'Added to calendar successfully')
-        })
-    elif 'authenticate' in calendar_result.get('error', '').lower():
-        # User needs to authorize
-        auth_url = _prepare_calendar_authorization(request.referrer)
-        if not auth_url:
+        if calendar_result.get('success'):
+            plan['calendar_added'] = True
+            plan['calendar_event_ids'] = calendar_result.get('event_ids', [])
+            save_meal_plans(meal_plans)
+            return jsonify({
+                'success': True,
+                'message': calendar_result.get('message', 'Added to calendar successfully')
+            })
+        elif 'authenticate' in calendar_result.get('error', '').lower():
+            # User needs to authorize
+            auth_url = _prepare_calendar_authorization(request.referrer)
+            if not auth_url:
+                return jsonify({
+                    'success': False,
+                    'error': 'Could not generate authorization URL. Please ensure credentials.json is configured.'
+                }), 500
+
+            return jsonify({
+                'success': False,
+                'needs_authorization': True,
+                'authorization_url': auth_url,
+                'message': 'Please authorize Google Calendar access first'
+            })
+        else:
             return jsonify({
                 'success': False,
-                'error': 'Could not generate authorization URL. Please ensure credentials.json is configured.'
+                'error': calendar_result.get('error', 'Failed to add to calendar')
             }), 500
 
-        return jsonify({
-            'success': False,
-            'needs_authorization': True,
-            'authorization_url': auth_url,
-            'message': 'Please authorize Google Calendar access first'
-        })
-    else:
-        return jsonify({
-            'success': False,
-            'error': calendar_result.get('error', 'Failed to add to calendar')
-        }), 500
-
 
 @app.route('/meal-plans/<int:plan_id>/delete', methods=['POST'])
 def delete_meal_plan(plan_id):
     """Delete a meal plan permanently."""
-    meal_plans = load_meal_plans()
-    plan = next((p for p in meal_plans if p.get('id') == plan_id), None)
+    with _MEAL_PLANS_LOCK:
+        meal_plans = load_meal_plans()
+        plan = get_meal_plan_by_id(plan_id)
 
-    if not plan:
-        return jsonify({'error': 'Meal plan not found'}), 404
+        if not plan:
+            return jsonify({'error': 'Meal plan not found'}), 404
 
-    # Remove from meal plans list
-    meal_plans = [p for p in meal_plans if p.get('id') != plan_id]
-    save_meal_plans(meal_plans)
+        # Remove from meal plans list
+        meal_plans = [p for p in meal_plans if p.get('id') != plan_id]
+        save_meal_plans(meal_plans)
 
     return jsonify({'success': True, 'redirect': url_for('meal_plans')})
 
@@ -1280,19 +1907,20 @@ def delete_meal_plan(plan_id):
 @app.route('/meal-plans/<int:plan_id>/archive', methods=['POST'])
 def archive_meal_plan(plan_id):
     """Archive an accepted meal plan."""
-    meal_plans = load_meal_plans()
-    plan = next((p for p in meal_plans if p.get('id') == plan_id), None)
+    with _MEAL_PLANS_LOCK:
+        meal_plans = load_meal_plans()
+        plan = get_meal_plan_by_id(plan_id)
 
-    if not plan:
-        return jsonify({'error': 'Meal plan not found'}), 404
+        if not plan:
+            return jsonify({'error': 'Meal plan not found'}), 404
 
-    if plan.get('status') != 'accepted':
-        return jsonify({'error': 'Can only archive accepted plans'}), 400
+        if plan.get('status') != 'accepted':
+            return jsonify({'error': 'Can only archive accepted plans'}), 400
 
-    plan['status'] = 'archived'
-    plan['archived_at'] = datetime.now().isoformat()
+        plan['status'] = 'archived'
+        plan['archived_at'] = datetime.now().isoformat()
 
-    save_meal_plans(meal_plans)
+        save_meal_plans(meal_plans)
 
     return jsonify({'success': True, 'message': 'Meal plan archived successfully'})
 
@@ -20,6 +20,9 @@ fi
 if [ "$1" == "fast" ]; then
     echo "🚀 Running tests (fast mode - no coverage)..."
     pytest -v
+elif [ "$1" == "quick" ]; then
+    echo "⚡ Running tests without end-to-end workflows..."
+    pytest -m "not integration"
 elif [ "$1" == "watch" ]; then
     echo "👀 Running tests in watch mode..."
     pytest-watch -v
@@ -43,6 +46,7 @@ else
     echo "Usage:"
     echo "  ./run_tests.sh          - Run all tests with coverage (default)"
     echo "  ./run_tests.sh fast     - Run tests without coverage"
+    echo "  ./run_tests.sh quick    - Run tests without end-to-end workflows"
     echo "  ./run_tests.sh coverage - Run tests with detailed coverage report"
     echo "  ./run_tests.sh unit     - Run only unit tests"
     echo "  ./run_tests.sh integration - Run only integration tests"
@@ -1,62 +1,98 @@
 """Pytest configuration and shared fixtures."""
 import json
 import os
-import tempfile
 
 import pytest
 
+# Keep imports of app from writing a persistent key into the real data directory
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+# Tests check password behavior, not hash cost, so use the cheapest Argon2 settings
+os.environ.setdefault('ARGON2_TIME_COST', '1')
+os.environ.setdefault('ARGON2_MEMORY_KIB', '8')
+os.environ.setdefault('ARGON2_PARALLELISM', '1')
+
 import app as app_module
 from app import app as flask_app
 
+# The test user's hash is computed once at import and reused by every test
+TEST_USER_PASSWORD_HASH = app_module.hash_password('testpass123')
+TEST_CSRF_TOKEN = 'test-csrf-token'
 
-@pytest.fixture
-def app():
-    """Create and configure a test instance of the Flask app."""
-    # Create a temporary directory for test data
-    test_data_dir = tempfile.mkdtemp()
 
-    # Configure app for testing
-    flask_app.config.update({
-        'TESTING': True,
-        'SECRET_KEY': 'test-secret-key'
-    })
+def pytest_configure(config):
+    """Register the suite's custom markers."""
+    config.addinivalue_line('markers', 'integration: end-to-end workflows across several routes')
+
+
+@pytest.fixture(scope='session')
+def _app_session(tmp_path_factory):
+    """Create the session's data directory and seed the test user once."""
+    test_data_dir = str(tmp_path_factory.mktemp('data'))
 
     # Override data directory paths
     app_module.DATA_DIR = test_data_dir
     app_module.RECIPES_FILE = os.path.join(test_data_dir, 'recipes.json')
     app_module.MEAL_PLANS_FILE = os.path.join(test_data_dir, 'meal_plans.json')
     app_module.USERS_FILE = os.path.join(test_data_dir, 'users.json')
-    app_module.LOGIN_ATTEMPTS.clear()
 
     test_user = {
         'id': 1,
         'username': 'testuser',
-        'password_hash': app_module.hash_password('testpass123'),
+        'password_hash': TEST_USER_PASSWORD_HASH,
         'created_at': '2024-01-01T12:00:00',
         'updated_at': '2024-01-01T12:00:00'
     }
     app_module.save_users([test_user])
+    with open(app_module.USERS_FILE, 'rb') as f:
+        users_snapshot = f.read()
+
+    # pytest removes old tmp_path_factory directories itself
+    return test_data_dir, users_snapshot
+
+
+@pytest.fixture
+def app(_app_session):
+    """Create and configure a test instance of the Flask app."""
+    test_data_dir, users_snapshot = _app_session
+
+    # Configure app for testing
+    flask_app.config.update({
+        'TESTING': True,
+        'SECRET_KEY': 'test-secret-key'
+    })
+    app_module.LOGIN_ATTEMPTS.clear()
+    app_module._AI_ORDER_CACHE.clear()
+    app_module.AI_BACKGROUND_SELECTION = False
 
     yield flask_app
 
-    # Cleanup
-    import shutil
-    shutil.rmtree(test_data_dir, ignore_errors=True)
+    # Reset the data directory to the seeded users file for the next test
+    for name in os.listdir(test_data_dir):
+        if name != 'users.json':
+            os.remove(os.path.join(test_data_dir, name))
+    with open(app_module.USERS_FILE, 'wb') as f:
+        f.write(users_snapshot)
+    app_module._JSON_CACHE.clear()
+
+
+@pytest.fixture(scope='session')
+def _auth_session_cookie():
+    """Sign the session /login would create once; the login route itself is covered in test_routes.py."""
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    return serializer.dumps({
+        '_permanent': True,
+        'username': 'testuser',
+        'user_id': 1,
+        'csrf_token': TEST_CSRF_TOKEN
+    })
 
 
 @pytest.fixture
-def client(app):
+def client(app, _auth_session_cookie):
     """Create an authenticated test client for the Flask app."""
     client = app.test_client()
-    client.post('/login', data={
-        'username': 'testuser',
-        'password': 'testpass123'
-    })
-
-    csrf_token = 'test-csrf-token'
-    with client.session_transaction() as sess:
-        sess['csrf_token'] = csrf_token
-    client.environ_base['HTTP_X_CSRF_TOKEN'] = csrf_token
+    client.set_cookie(app.config['SESSION_COOKIE_NAME'], _auth_session_cookie)
+    client.environ_base['HTTP_X_CSRF_TOKEN'] = TEST_CSRF_TOKEN
 
     return client
 
@@ -1,23 +1,45 @@
 """Unit tests for AI integration functions in app.py."""
 import json
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
 from unittest.mock import MagicMock, Mock, patch
 
 import pytest
 
-from app import generate_meal_plan_with_ai, get_ai_client
+import app as app_module
+from app import (generate_meal_plan_with_ai, get_ai_client, get_meal_plan_by_id, load_meal_plans,
+                 save_meal_plans, save_recipes)
+
+
+def streamed_completion(*parts):
+    """Build the chunks returned by a streamed OpenAI chat completion."""
+    return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+                 for text in parts])
 
 
 @pytest.fixture(autouse=True)
-def force_openai_provider():
+def force_openai_provider(monkeypatch):
     """Force OpenAI code path for deterministic AI unit tests."""
-    with patch('app.AI_PROVIDER', 'openai'):
-        yield
+    app_module._AI_ORDER_CACHE.clear()
+    app_module._AI_CLIENT = None
+    monkeypatch.setattr(app_module, 'AI_PROVIDER', 'openai')
+    monkeypatch.setattr(app_module, 'AI_REORDER_MIN_RECIPES', 1)
+
+
+@pytest.fixture
+def ai_client(monkeypatch):
+    """Patch get_ai_client with a mock that tests load with a streamed reply."""
+    mock_client = Mock()
+    monkeypatch.setattr(app_module, 'get_ai_client', lambda: mock_client)
+    return mock_client
 
 
 class TestAIClient:
     """Tests for AI client configuration."""
 
-    @patch('app.OpenAI')
+    @patch('openai.OpenAI')
     def test_get_ai_client(self, mock_openai):
         """Test AI client creation."""
         client = get_ai_client()
@@ -27,25 +49,44 @@ class TestAIClient:
         call_kwargs = mock_openai.call_args[1]
         assert 'base_url' in call_kwargs
         assert 'api_key' in call_kwargs
+        assert 'http_client' in call_kwargs
+
+    @patch('openai.OpenAI')
+    def test_get_ai_client_reuses_shared_client(self, mock_openai, monkeypatch):
+        """Test the AI client is created once and reused until config changes."""
+        first = get_ai_client()
+        second = get_ai_client()
+
+        assert first is second
+        mock_openai.assert_called_once()
+
+        monkeypatch.setattr(app_module, 'AI_BASE_URL', 'http://other-host:1234/v1')
+        get_ai_client()
+        assert mock_openai.call_count == 2
+
+
+    def test_app_import_defers_provider_sdks(self):
+        """Test importing the app does not load the AI provider SDKs."""
+        result = subprocess.run(
+            [sys.executable, '-c', "import sys, app; print('openai' in sys.modules, 'google.genai' in sys.modules)"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True, text=True, check=True
+        )
+        assert result.stdout.split() == ['False', 'False']
 
 
 class TestAIMealPlanGeneration:
     """Tests for AI-powered meal plan generation."""
 
-    def test_generate_meal_plan_with_ai_success(self, sample_recipes):
+    def test_generate_meal_plan_with_ai_success(self, sample_recipes, ai_client):
         """Test successful AI meal plan generation."""
         # Mock the AI client and response
-        mock_client = Mock()
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = json.dumps([3, 1, 2])
-        mock_client.chat.completions.create.return_value = mock_response
+        ai_client.chat.completions.create.return_value = streamed_completion(json.dumps([3, 1, 2]))
 
-        with patch('app.get_ai_client', return_value=mock_client):
-            result = generate_meal_plan_with_ai(sample_recipes[:3])
+        result = generate_meal_plan_with_ai(sample_recipes[:3])
 
         # Verify AI was called
-        mock_client.chat.completions.create.assert_called_once()
+        ai_client.chat.completions.create.assert_called_once()
 
         # Verify result
         assert len(result) == 3
@@ -53,44 +94,56 @@ class TestAIMealPlanGeneration:
         assert result[1]['id'] == 1
         assert result[2]['id'] == 2
 
-    def test_generate_meal_plan_with_ai_invalid_json(self, sample_recipes):
+    def test_generate_meal_plan_with_ai_invalid_json(self, sample_recipes, ai_client):
         """Test AI response with invalid JSON."""
-        mock_client = Mock()
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = "This is not JSON"
-        mock_client.chat.completions.create.return_value = mock_response
+        ai_client.chat.completions.create.return_value = streamed_completion("This is not JSON")
 
-        with patch('app.get_ai_client', return_value=mock_client):
-            result = generate_meal_plan_with_ai(sample_recipes[:3])
+        result = generate_meal_plan_with_ai(sample_recipes[:3])
 
         # Should fallback to original order
         assert len(result) == 3
         assert result[0]['id'] == sample_recipes[0]['id']
 
-    def test_generate_meal_plan_with_ai_connection_error(self, sample_recipes):
+    def test_generate_meal_plan_with_ai_json_wrapped_in_prose(self, sample_recipes, ai_client):
+        """Test recipe numbers are recovered from an array wrapped in prose."""
+        ai_client.chat.completions.create.return_value = streamed_completion(
+            'Here is the plan: [3, 1, 2] enjoy!'
+        )
+
+        result = generate_meal_plan_with_ai(sample_recipes[:3])
+
+        assert [r['id'] for r in result] == [sample_recipes[i]['id'] for i in (2, 0, 1)]
+
+    def test_generate_meal_plan_with_ai_incomplete_json(self, sample_recipes, ai_client):
+        """Test recipe numbers are recovered from an unterminated array."""
+        ai_client.chat.completions.create.return_value = streamed_completion('[3, 1, 2,')
+
+        result = generate_meal_plan_with_ai(sample_recipes[:3])
+
+        assert [r['id'] for r in result] == [sample_recipes[i]['id'] for i in (2, 0, 1)]
+
+    def test_generate_meal_plan_with_ai_connection_error(self, sample_recipes, ai_client):
         """Test handling of AI connection errors."""
-        mock_client = Mock()
-        mock_client.chat.completions.create.side_effect = Exception("Connection failed")
+        ai_client.chat.completions.create.side_effect = Exception("Connection failed")
 
-        with patch('app.get_ai_client', return_value=mock_client):
-            result = generate_meal_plan_with_ai(sample_recipes[:3])
+        result = generate_meal_plan_with_ai(sample_recipes[:3])
 
         # Should fallback to original order
         assert len(result) == 3
         assert result == sample_recipes[:3]
 
-    def test_generate_meal_plan_with_ai_out_of_range_indices(self, sample_recipes):
+    def test_generate_meal_plan_with_ai_without_fallback_returns_none(self, sample_recipes, ai_client):
+        """Test callers that opt out of the fallback get None when the AI fails."""
+        ai_client.chat.completions.create.side_effect = Exception("Connection failed")
+
+        assert generate_meal_plan_with_ai(sample_recipes[:3], fallback=False) is None
+
+    def test_generate_meal_plan_with_ai_out_of_range_indices(self, sample_recipes, ai_client):
         """Test AI response with out-of-range indices."""
-        mock_client = Mock()
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
         # Some indices out of range
-        mock_response.choices[0].message.content = json.dumps([1, 99, 2, 0, 3])
-        mock_client.chat.completions.create.return_value = mock_response
+        ai_client.chat.completions.create.return_value = streamed_completion(json.dumps([1, 99, 2, 0, 3]))
 
-        with patch('app.get_ai_client', return_value=mock_client):
-            result = generate_meal_plan_with_ai(sample_recipes[:3])
+        result = generate_meal_plan_with_ai(sample_recipes[:3])
 
         # Should only include valid indices (1, 2, 3)
         assert len(result) == 3
@@ -98,65 +151,97 @@ class TestAIMealPlanGeneration:
         result_ids = [r['id'] for r in result]
         assert all(rid in valid_ids for rid in result_ids)
 
-    def test_generate_meal_plan_with_ai_duplicate_indices(self, sample_recipes):
+    def test_generate_meal_plan_with_ai_duplicate_indices(self, sample_recipes, ai_client):
         """Test AI response with duplicate indices."""
-        mock_client = Mock()
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
         # Duplicates
-        mock_response.choices[0].message.content = json.dumps([1, 1, 2, 2, 3])
-        mock_client.chat.completions.create.return_value = mock_response
+        ai_client.chat.completions.create.return_value = streamed_completion(json.dumps([1, 1, 2, 2, 3]))
 
-        with patch('app.get_ai_client', return_value=mock_client):
-            result = generate_meal_plan_with_ai(sample_recipes[:3])
+        result = generate_meal_plan_with_ai(sample_recipes[:3])
 
         # Should handle duplicates - first occurrence is used
         assert len(result) == 3
 
-    def test_generate_meal_plan_with_ai_partial_response(self, sample_recipes):
+    def test_generate_meal_plan_with_ai_fills_missing_in_candidate_order(self, sample_recipes, ai_client):
+        """Test missing picks are filled once each, in candidate order."""
+        ai_client.chat.completions.create.return_value = streamed_completion(json.dumps([4, 4, 2]))
+
+        result = generate_meal_plan_with_ai(sample_recipes[:5])
+
+        assert [r['id'] for r in result] == [4, 2, 1, 3, 5]
+
+    def test_generate_meal_plan_with_ai_partial_response(self, sample_recipes, ai_client):
         """Test AI response with fewer indices than recipes."""
-        mock_client = Mock()
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
         # Only 2 indices for 3 recipes
-        mock_response.choices[0].message.content = json.dumps([2, 1])
-        mock_client.chat.completions.create.return_value = mock_response
+        ai_client.chat.completions.create.return_value = streamed_completion(json.dumps([2, 1]))
 
-        with patch('app.get_ai_client', return_value=mock_client):
-            result = generate_meal_plan_with_ai(sample_recipes[:3])
+        result = generate_meal_plan_with_ai(sample_recipes[:3])
 
         # Should include all recipes (missing one gets added)
         assert len(result) == 3
 
-    def test_generate_meal_plan_with_ai_empty_recipes(self):
-        """Test AI meal plan generation with empty recipe list."""
-        mock_client = Mock()
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = json.dumps([])
-        mock_client.chat.completions.create.return_value = mock_response
+    def test_generate_meal_plan_with_ai_empty_recipes(self, ai_client):
+        """Test an empty candidate list returns immediately without calling the AI."""
+        assert generate_meal_plan_with_ai([]) == []
+        ai_client.chat.completions.create.assert_not_called()
+
+    def test_generate_meal_plan_with_ai_skips_small_candidate_lists(self, sample_recipes, ai_client, monkeypatch):
+        """Test small candidate lists are returned without calling the AI."""
+        monkeypatch.setattr(app_module, 'AI_REORDER_MIN_RECIPES', 4)
+        result = generate_meal_plan_with_ai(sample_recipes[:3], days=2)
+
+        ai_client.chat.completions.create.assert_not_called()
+        assert result == sample_recipes[:2]
+
+    def test_generate_meal_plan_with_ai_caches_repeat_prompts(self, sample_recipes, ai_client):
+        """Test identical candidate lists reuse the previous AI selection."""
+        ai_client.chat.completions.create.return_value = streamed_completion(json.dumps([3, 1, 2]))
+
+        first = generate_meal_plan_with_ai(sample_recipes[:3])
+        second = generate_meal_plan_with_ai(sample_recipes[:3])
+        generate_meal_plan_with_ai(sample_recipes[:3], days=2)
 
-        with patch('app.get_ai_client', return_value=mock_client):
-            result = generate_meal_plan_with_ai([])
+        assert [r['id'] for r in second] == [r['id'] for r in first] == [3, 1, 2]
+        assert ai_client.chat.completions.create.call_count == 2
 
-        assert result == []
+    def test_generate_meal_plan_with_ai_does_not_cache_fallbacks(self, sample_recipes, ai_client):
+        """Test invalid AI responses are retried on the next request."""
+        ai_client.chat.completions.create.return_value = streamed_completion("This is not JSON")
 
-    def test_generate_meal_plan_ai_prompt_format(self, sample_recipes):
+        generate_meal_plan_with_ai(sample_recipes[:3])
+        generate_meal_plan_with_ai(sample_recipes[:3])
+
+        assert ai_client.chat.completions.create.call_count == 2
+
+    def test_generate_meal_plan_with_ai_does_not_cache_recovered_selections(self, sample_recipes, ai_client):
+        """Test selections recovered from prose are not reused for later requests."""
+        ai_client.chat.completions.create.side_effect = lambda **kwargs: streamed_completion('Try [3, 1, 2]')
+
+        generate_meal_plan_with_ai(sample_recipes[:3])
+        generate_meal_plan_with_ai(sample_recipes[:3])
+
+        assert ai_client.chat.completions.create.call_count == 2
+
+    def test_generate_meal_plan_with_ai_does_not_cache_padded_selections(self, sample_recipes, ai_client):
+        """Test selections padded with fallback candidates are not reused for later requests."""
+        ai_client.chat.completions.create.side_effect = lambda **kwargs: streamed_completion(json.dumps([2]))
+
+        result = generate_meal_plan_with_ai(sample_recipes[:3])
+        generate_meal_plan_with_ai(sample_recipes[:3])
+
+        assert [r['id'] for r in result] == [2, 1, 3]
+        assert ai_client.chat.completions.create.call_count == 2
+
+    def test_generate_meal_plan_ai_prompt_format(self, sample_recipes, ai_client):
         """Test that AI prompt is correctly formatted."""
-        mock_client = Mock()
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = json.dumps([1, 2, 3])
-        mock_client.chat.completions.create.return_value = mock_response
-
-        with patch('app.get_ai_client', return_value=mock_client):
-            generate_meal_plan_with_ai(
-                sample_recipes[:3],
-                recent_recipes=[{'name': 'Recent Chili'}, {'name': 'Chicken Curry'}]
-            )
+        ai_client.chat.completions.create.return_value = streamed_completion(json.dumps([1, 2, 3]))
+
+        generate_meal_plan_with_ai(
+            sample_recipes[:3],
+            recent_recipes=[{'name': 'Recent Chili'}, {'name': 'Chicken Curry'}]
+        )
 
         # Get the call arguments
-        call_args = mock_client.chat.completions.create.call_args
+        call_args = ai_client.chat.completions.create.call_args
         messages = call_args[1]['messages']
 
         # Verify message structure
@@ -172,57 +257,75 @@ class TestAIMealPlanGeneration:
         assert 'Maximize variety across the week' in user_prompt
         assert 'Recent Chili' in user_prompt
 
-    def test_generate_meal_plan_ai_parameters(self, sample_recipes):
+    def test_generate_meal_plan_with_ai_prompt_trims_descriptions(self, sample_recipes, ai_client):
+        """Test that long descriptions are truncated and missing ones are omitted."""
+        recipes = [dict(r) for r in sample_recipes[:2]]
+        recipes[0]['description'] = 'x' * 200
+        recipes[1].pop('description', None)
+
+        ai_client.chat.completions.create.return_value = streamed_completion(json.dumps([1, 2]))
+
+        generate_meal_plan_with_ai(recipes)
+
+        user_prompt = ai_client.chat.completions.create.call_args[1]['messages'][1]['content']
+        assert f"1. {recipes[0]['name']} (Pasta): {'x' * 80}\n" in user_prompt
+        assert f"2. {recipes[1]['name']} (Chicken)\n" in user_prompt
+        assert 'No description' not in user_prompt
+
+    def test_generate_meal_plan_ai_parameters(self, sample_recipes, ai_client, monkeypatch):
         """Test that AI is called with correct parameters."""
-        mock_client = Mock()
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = json.dumps([1, 2])
-        mock_client.chat.completions.create.return_value = mock_response
+        ai_client.chat.completions.create.return_value = streamed_completion(json.dumps([1, 2]))
+        monkeypatch.setattr(app_module, 'AI_MODEL', 'test-model')
 
-        with patch('app.get_ai_client', return_value=mock_client):
-            with patch('app.AI_MODEL', 'test-model'):
-                generate_meal_plan_with_ai(sample_recipes[:2])
+        generate_meal_plan_with_ai(sample_recipes[:2])
 
-        call_args = mock_client.chat.completions.create.call_args[1]
+        call_args = ai_client.chat.completions.create.call_args[1]
 
         assert call_args['model'] == 'test-model'
         assert 'temperature' in call_args
         assert 'max_tokens' in call_args
         assert call_args['temperature'] == 0.7
-        assert call_args['max_tokens'] == 200
+        assert call_args['max_tokens'] == 64
+        assert call_args['stream'] is True
+
+    def test_generate_meal_plan_with_ai_stops_at_closing_bracket(self, sample_recipes, ai_client):
+        """Test that streaming stops once the JSON array is complete."""
+        def chunks():
+            yield from streamed_completion('[2, ', '1', ']')
+            raise AssertionError('stream read past the closing bracket')
+
+        ai_client.chat.completions.create.return_value = chunks()
+
+        result = generate_meal_plan_with_ai(sample_recipes[:2])
+
+        assert result == [sample_recipes[1], sample_recipes[0]]
 
 
 class TestAIIntegration:
     """Integration tests for AI functionality."""
 
-    @patch('app.get_ai_client')
-    def test_ai_integration_in_meal_plan_generation(self, mock_get_client, client, sample_recipes):
+    @pytest.fixture(autouse=True)
+    def saved_recipes(self, app, sample_recipes):
+        """Save the sample recipes that every integration test generates plans from."""
+        save_recipes(sample_recipes)
+        return sample_recipes
+
+    def test_ai_integration_in_meal_plan_generation(self, client, ai_client):
         """Test AI integration in the full meal plan generation flow."""
         # Setup mock AI response
-        mock_ai_client = Mock()
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = json.dumps([7, 6, 5, 4, 3, 2, 1])
-        mock_ai_client.chat.completions.create.return_value = mock_response
-        mock_get_client.return_value = mock_ai_client
-
-        # Save recipes
-        save_recipes(sample_recipes)
+        ai_client.chat.completions.create.return_value = streamed_completion(json.dumps([7, 6, 5, 4, 3, 2, 1]))
 
         # Generate meal plan with AI
         plan_request = {'days': 7, 'use_ai': True}
         response = client.post('/meal-plans/generate',
-                             data=json.dumps(plan_request),
-                             content_type='application/json')
+                             json=plan_request)
 
         assert response.status_code == 200
 
         # Verify AI was called
-        mock_ai_client.chat.completions.create.assert_called_once()
+        ai_client.chat.completions.create.assert_called_once()
 
         # Load and verify the meal plan
-        from app import load_meal_plans
         plans = load_meal_plans()
         assert len(plans) == 1
 
@@ -234,21 +337,38 @@ class TestAIIntegration:
         assert len(plan_recipe_ids) == 7
         assert set(plan_recipe_ids) == set([1, 2, 3, 4, 5, 6, 7])
 
-    def test_ai_disabled_in_meal_plan_generation(self, client, sample_recipes):
+    def test_background_selection_keeps_staged_recipes_on_ai_fallback(self, saved_recipes, ai_client):
+        """Test an unusable AI answer leaves the staged weighted selection in place."""
+        ai_client.chat.completions.create.return_value = streamed_completion("I cannot help with that")
+        staged_recipes = [saved_recipes[4], saved_recipes[2]]
+        save_meal_plans([{
+            'id': 1,
+            'created_at': '2024-01-01T12:00:00',
+            'start_date': '2024-01-08',
+            'days': 2,
+            'recipes': staged_recipes,
+            'grocery_list': [],
+            'status': 'staged',
+            'ai_pending': True
+        }])
+
+        app_module._complete_ai_selection(1, saved_recipes, 2, [])
+
+        ai_client.chat.completions.create.assert_called_once()
+        plan = get_meal_plan_by_id(1)
+        assert plan['recipes'] == staged_recipes
+        assert plan['ai_pending'] is False
+
+    def test_ai_disabled_in_meal_plan_generation(self, client, monkeypatch):
         """Test meal plan generation without AI."""
-        save_recipes(sample_recipes)
+        mock_ai = Mock()
+        monkeypatch.setattr(app_module, 'generate_meal_plan_with_ai', mock_ai)
 
         plan_request = {'days': 5, 'use_ai': False}
+        response = client.post('/meal-plans/generate',
+                             json=plan_request)
 
-        with patch('app.generate_meal_plan_with_ai') as mock_ai:
-            response = client.post('/meal-plans/generate',
-                                 data=json.dumps(plan_request),
-                                 content_type='application/json')
-
-            assert response.status_code == 200
-            # AI function should not be called
-            mock_ai.assert_not_called()
-
+        assert response.status_code == 200
+        # AI function should not be called
+        mock_ai.assert_not_called()
 
-# Import at the end to avoid circular imports during testing
-from app import save_meal_plans, save_recipes
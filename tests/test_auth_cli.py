@@ -1,7 +1,10 @@
 """Tests for authentication-related Flask CLI commands."""
 
+import json
 import os
 
+from argon2 import PasswordHasher
+
 import app as app_module
 from app import find_user_by_username, load_users
 
@@ -18,6 +21,38 @@ class TestAuthCLI:
         assert users == []
         assert find_user_by_username('admin') is None
 
+    def test_users_cache_picks_up_external_changes(self, app):
+        """Users are served from cache until another process rewrites the store."""
+        assert load_users() is load_users()
+        assert find_user_by_username(' TestUser ')['id'] == 1
+
+        with open(app_module.USERS_FILE, 'w') as f:
+            json.dump({'version': 1, 'users': [{
+                'id': 2,
+                'username': 'bob',
+                'password_hash': app_module.hash_password('bobpass123')
+            }]}, f)
+
+        assert find_user_by_username('testuser') is None
+        assert find_user_by_username('BOB')['id'] == 2
+
+    def test_canonical_users_store_skips_migration(self, app):
+        """Users already in the current format are returned without rewriting."""
+        users_data = app_module._normalize_users_data({'version': 1, 'users': load_users()})
+        assert app_module._migrate_users_data(users_data) == (users_data, False)
+
+    def test_legacy_plaintext_password_is_migrated(self, app):
+        """Legacy plaintext passwords are hashed and removed on load."""
+        with open(app_module.USERS_FILE, 'w') as f:
+            json.dump([{'username': 'legacy', 'password': 'legacypass123'}], f)
+
+        user = find_user_by_username('legacy')
+        assert 'password' not in user
+        assert app_module.verify_password(user['password_hash'], 'legacypass123')
+
+        with open(app_module.USERS_FILE) as f:
+            assert 'legacypass123' not in f.read()
+
     def test_create_user_command_success(self, runner):
         """Create-user command adds a new user with hashed password."""
         result = runner.invoke(
@@ -71,3 +106,14 @@ class TestAuthCLI:
 
         assert result.exit_code != 0
         assert "User 'missing-user' not found." in result.output
+
+    def test_argon2_calibrate_command_reports_settings(self, runner, monkeypatch):
+        """Argon2-calibrate echoes env settings for the measured time cost."""
+        # Calibrate at the default 64 MiB so a single pass exceeds the 1 ms target
+        monkeypatch.setattr(app_module, 'PASSWORD_HASHER', PasswordHasher(memory_cost=65536, parallelism=4))
+        result = runner.invoke(args=['argon2-calibrate', '--target-ms', '1'])
+
+        assert result.exit_code == 0
+        assert 'ARGON2_TIME_COST=1' in result.output
+        assert f'ARGON2_MEMORY_KIB={app_module.PASSWORD_HASHER.memory_cost}' in result.output
+        assert f'ARGON2_PARALLELISM={app_module.PASSWORD_HASHER.parallelism}' in result.output
@@ -1,13 +1,16 @@
 """Unit tests for Flask routes in app.py."""
+import gzip
 import json
-from datetime import datetime
-from unittest.mock import patch
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
 
 import pytest
 from flask import Flask, session
 
 import app as app_module
-from app import load_recipes, load_users, save_meal_plans, save_recipes
+from app import get_meal_plan_by_id, load_meal_plans, load_recipes, load_users, save_meal_plans, save_recipes
 
 
 class TestAuthRoutes:
@@ -28,10 +31,9 @@ class TestAuthRoutes:
     def test_json_route_requires_auth(self, unauth_client):
         """Test JSON endpoints return auth error when unauthenticated."""
         response = unauth_client.post('/meal-plans/generate',
-                                    data=json.dumps({'days': 7}),
-                                    content_type='application/json')
+                                    json={'days': 7})
         assert response.status_code == 401
-        data = json.loads(response.data)
+        data = response.get_json()
         assert data['error'] == 'Authentication required'
 
     def test_login_success(self, unauth_client):
@@ -53,6 +55,15 @@ class TestAuthRoutes:
         assert response.status_code == 302
         assert response.headers['Location'].endswith('/')
 
+    def test_safe_redirect_target_allows_only_local_paths(self, app):
+        """Test redirect targets are limited to in-app paths, including cached lookups."""
+        with app.test_request_context():
+            for _ in range(2):
+                assert app_module._get_safe_redirect_target('/recipes?page=2') == '/recipes?page=2'
+                assert app_module._get_safe_redirect_target('https://evil.example/') == '/'
+                assert app_module._get_safe_redirect_target('\\\\evil.example') == '/'
+                assert app_module._get_safe_redirect_target('') == '/'
+
     def test_login_invalid_credentials(self, unauth_client):
         """Test login failure with invalid credentials."""
         response = unauth_client.post('/login', data={
@@ -84,6 +95,12 @@ class TestAuthRoutes:
             if value.strip()
         }
 
+    def test_rendered_pages_embed_session_csrf_token(self, client):
+        """Test every CSRF field on a page carries the session token."""
+        response = client.get('/change-password')
+        assert response.status_code == 200
+        assert response.data.count(b'test-csrf-token') == 3
+
     def test_logout_ends_session(self, client):
         """Test logout removes access to protected routes."""
         response = client.post('/logout')
@@ -119,14 +136,14 @@ class TestAuthRoutes:
         assert response.status_code == 200
         assert b'Current password is incorrect' in response.data
 
-    def test_oauth_callback_uses_safe_return_url(self, client):
+    def test_oauth_callback_uses_safe_return_url(self, client, monkeypatch):
         """Test OAuth callback does not redirect to external URLs."""
         with client.session_transaction() as sess:
             sess['oauth_state'] = 'state123'
             sess['oauth_return_url'] = 'https://evil.example/capture'
 
-        with patch('app.exchange_code_for_token', return_value={'success': True}):
-            response = client.get('/oauth2callback?state=state123&code=abc123')
+        monkeypatch.setattr(app_module, 'exchange_code_for_token', Mock(return_value={'success': True}))
+        response = client.get('/oauth2callback?state=state123&code=abc123')
 
         assert response.status_code == 302
         assert response.headers['Location'].endswith('/')
@@ -154,6 +171,31 @@ class TestAuthRoutes:
         assert third.status_code == 429
         assert b'Too many failed login attempts' in third.data
 
+    def test_concurrent_failed_logins_are_rate_limited(self, unauth_client, monkeypatch):
+        """Test concurrent failed logins share one rate-limit record without server errors."""
+        monkeypatch.setattr(app_module, 'MAX_LOGIN_ATTEMPTS', 3)
+        monkeypatch.setattr(app_module, 'LOGIN_ATTEMPTS_SWEEP_SECONDS', 0)
+
+        def fail_login(_):
+            return unauth_client.post('/login', data={'username': 'testuser', 'password': 'wrong-password'})
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(fail_login, range(16)))
+
+        assert {response.status_code for response in responses} <= {200, 429}
+        assert [len(attempts) for attempts in app_module.LOGIN_ATTEMPTS.values()] == [3]
+
+    def test_login_attempt_sweep_forgets_expired_identifiers(self, unauth_client, monkeypatch):
+        """Test identifiers whose attempts have expired are evicted by the periodic sweep."""
+        monkeypatch.setattr(app_module, 'LOGIN_ATTEMPTS_SWEEP_SECONDS', 0)
+        stale_attempt = datetime.now() - timedelta(minutes=app_module.LOGIN_RATE_LIMIT_WINDOW_MINUTES + 1)
+        app_module.LOGIN_ATTEMPTS['203.0.113.9:mallory'] = deque([stale_attempt])
+
+        unauth_client.post('/login', data={'username': 'testuser', 'password': 'wrong-password'})
+
+        assert '203.0.113.9:mallory' not in app_module.LOGIN_ATTEMPTS
+        assert len(app_module.LOGIN_ATTEMPTS) == 1
+
 
 class TestIndexRoute:
     """Tests for the index/home route."""
@@ -188,6 +230,15 @@ class TestRecipesRoutes:
         response = client.get('/recipes')
         assert response.status_code == 200
 
+    def test_recipes_list_is_compressed(self, client, sample_recipes):
+        """Test large HTML pages are compressed for clients that accept it."""
+        save_recipes(sample_recipes)
+
+        response = client.get('/recipes', headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert b'Spaghetti Carbonara' in gzip.decompress(response.data)
+
     def test_add_recipe_get(self, client):
         """Test GET request to add recipe page."""
         response = client.get('/recipes/add')
@@ -208,11 +259,10 @@ class TestRecipesRoutes:
         }
 
         response = client.post('/recipes/add',
-                             data=json.dumps(recipe_data),
-                             content_type='application/json')
+                             json=recipe_data)
 
         assert response.status_code == 200
-        data = json.loads(response.data)
+        data = response.get_json()
         assert data['success'] is True
         assert 'id' in data
         assert data['id'] == 1
@@ -229,10 +279,9 @@ class TestRecipesRoutes:
         }
 
         response = client.post('/recipes/add',
-                             data=json.dumps(new_recipe),
-                             content_type='application/json')
+                             json=new_recipe)
 
-        data = json.loads(response.data)
+        data = response.get_json()
         assert data['id'] == 2  # Should be next ID after existing recipe
 
     def test_view_recipe_success(self, client, sample_recipe):
@@ -255,7 +304,7 @@ class TestRecipesRoutes:
         response = client.post('/recipes/1/delete')
 
         assert response.status_code == 200
-        data = json.loads(response.data)
+        data = response.get_json()
         assert data['success'] is True
         assert load_recipes() == []
 
@@ -264,7 +313,7 @@ class TestRecipesRoutes:
         response = client.post('/recipes/999/delete')
 
         assert response.status_code == 404
-        data = json.loads(response.data)
+        data = response.get_json()
         assert data['error'] == 'Recipe not found'
 
 
@@ -295,6 +344,26 @@ class TestMealPlansRoutes:
         response = client.get('/meal-plans')
         assert response.status_code == 200
 
+    def test_meal_plans_list_paginated(self, client):
+        """Test meal plans are paged newest first and out-of-range pages clamp."""
+        plans = [
+            {'id': i, 'created_at': f'2024-01-{i:02d}T12:00:00', 'start_date': f'2024-02-{i:02d}',
+             'days': 7, 'recipes': []}
+            for i in range(1, 6)
+        ]
+        save_meal_plans(plans)
+
+        response = client.get('/meal-plans?page=2&size=2')
+        assert response.status_code == 200
+        assert b'2024-02-03' in response.data
+        assert b'2024-02-02' in response.data
+        assert b'2024-02-05' not in response.data
+        assert b'Page 2 of 3' in response.data
+
+        response = client.get('/meal-plans?page=99&size=2')
+        assert b'Page 3 of 3' in response.data
+        assert b'2024-02-01' in response.data
+
     def test_generate_meal_plan_get(self, client):
         """Test GET request to generate meal plan page."""
         response = client.get('/meal-plans/generate')
@@ -317,11 +386,10 @@ class TestMealPlansRoutes:
     def test_generate_meal_plan_post_no_recipes(self, client):
         """Test generating meal plan with no recipes."""
         response = client.post('/meal-plans/generate',
-                             data=json.dumps({'days': 7}),
-                             content_type='application/json')
+                             json={'days': 7})
 
         assert response.status_code == 400
-        data = json.loads(response.data)
+        data = response.get_json()
         assert 'error' in data
 
     def test_generate_meal_plan_post_success(self, client, sample_recipes):
@@ -335,15 +403,31 @@ class TestMealPlansRoutes:
         }
 
         response = client.post('/meal-plans/generate',
-                             data=json.dumps(plan_request),
-                             content_type='application/json')
+                             json=plan_request)
 
         assert response.status_code == 200
-        data = json.loads(response.data)
+        data = response.get_json()
         assert data['success'] is True
         assert 'id' in data
         assert 'redirect' in data
 
+    def test_concurrent_generates_get_distinct_ids(self, client, sample_recipes):
+        """Test plans generated concurrently are all saved with their own IDs."""
+        save_recipes(sample_recipes)
+
+        # Months apart, so no plan excludes another's recipes as recently used
+        def generate(month):
+            return client.post('/meal-plans/generate',
+                               json={'days': 1, 'use_ai': False, 'start_date': f'2024-{month:02d}-01'})
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(generate, range(1, 9)))
+
+        assert [response.status_code for response in responses] == [200] * 8
+        response_ids = sorted(response.get_json()['id'] for response in responses)
+        assert response_ids == list(range(1, 9))
+        assert sorted(plan['id'] for plan in load_meal_plans()) == response_ids
+
     def test_generate_meal_plan_creates_grocery_list(self, client, sample_recipes):
         """Test that meal plan generation creates a grocery list."""
         save_recipes(sample_recipes)
@@ -351,16 +435,13 @@ class TestMealPlansRoutes:
         plan_request = {'days': 3, 'use_ai': False}
 
         response = client.post('/meal-plans/generate',
-                             data=json.dumps(plan_request),
-                             content_type='application/json')
+                             json=plan_request)
 
         assert response.status_code == 200
-        data = json.loads(response.data)
+        data = response.get_json()
 
         # Load the created meal plan
-        from app import load_meal_plans
-        plans = load_meal_plans()
-        plan = next((p for p in plans if p['id'] == data['id']), None)
+        plan = get_meal_plan_by_id(data['id'])
 
         assert plan is not None
         assert 'grocery_list' in plan
@@ -371,15 +452,12 @@ class TestMealPlansRoutes:
         save_recipes(sample_recipes)
 
         response = client.post('/meal-plans/generate',
-                             data=json.dumps({'use_ai': False}),
-                             content_type='application/json')
+                             json={'use_ai': False})
 
         assert response.status_code == 200
-        data = json.loads(response.data)
+        data = response.get_json()
 
-        from app import load_meal_plans
-        plans = load_meal_plans()
-        plan = next((p for p in plans if p['id'] == data['id']), None)
+        plan = get_meal_plan_by_id(data['id'])
 
         assert plan['days'] == 7  # Default value
 
@@ -408,20 +486,17 @@ class TestMealPlansRoutes:
         }
 
         response = client.post('/meal-plans/generate',
-                             data=json.dumps(plan_request),
-                             content_type='application/json')
+                             json=plan_request)
 
         assert response.status_code == 200
-        data = json.loads(response.data)
+        data = response.get_json()
 
-        from app import load_meal_plans
-        plans = load_meal_plans()
-        plan = next((p for p in plans if p['id'] == data['id']), None)
+        plan = get_meal_plan_by_id(data['id'])
 
         generated_ids = {recipe['id'] for recipe in plan['recipes']}
         assert generated_ids.isdisjoint({1, 2, 3})
 
-    def test_generate_meal_plan_ai_receives_filtered_candidates(self, client, sample_recipes):
+    def test_generate_meal_plan_ai_receives_filtered_candidates(self, client, sample_recipes, monkeypatch):
         """Test AI selection receives candidate recipes with recent ones excluded."""
         save_recipes(sample_recipes)
 
@@ -439,16 +514,15 @@ class TestMealPlansRoutes:
         }
         save_meal_plans([recent_plan])
 
-        ai_result = sample_recipes[3:7]
-        with patch('app.generate_meal_plan_with_ai', return_value=ai_result) as mock_ai:
-            plan_request = {
-                'days': 4,
-                'use_ai': True,
-                'start_date': '2026-02-10'
-            }
-            response = client.post('/meal-plans/generate',
-                                 data=json.dumps(plan_request),
-                                 content_type='application/json')
+        mock_ai = Mock(return_value=sample_recipes[3:7])
+        monkeypatch.setattr(app_module, 'generate_meal_plan_with_ai', mock_ai)
+        plan_request = {
+            'days': 4,
+            'use_ai': True,
+            'start_date': '2026-02-10'
+        }
+        response = client.post('/meal-plans/generate',
+                             json=plan_request)
 
         assert response.status_code == 200
         mock_ai.assert_called_once()
@@ -463,6 +537,76 @@ class TestMealPlansRoutes:
             'Caesar Salad'
         ]
 
+    def test_generate_meal_plan_applies_ai_selection_in_background(self, client, sample_recipes, monkeypatch):
+        """Test AI plans are staged immediately and updated when the AI finishes."""
+        save_recipes(sample_recipes)
+        executor = ThreadPoolExecutor(max_workers=1)
+        monkeypatch.setattr(app_module, 'AI_BACKGROUND_SELECTION', True)
+        monkeypatch.setattr(app_module, 'AI_EXECUTOR', executor)
+
+        mock_ai = Mock(return_value=sample_recipes[3:7])
+        monkeypatch.setattr(app_module, 'generate_meal_plan_with_ai', mock_ai)
+        response = client.post('/meal-plans/generate',
+                             json={'days': 4, 'use_ai': True})
+        assert response.status_code == 200
+        executor.shutdown(wait=True)
+
+        mock_ai.assert_called_once()
+        plan_id = response.get_json()['id']
+        plan = app_module.get_meal_plan_by_id(plan_id)
+        assert plan['ai_pending'] is False
+        assert [r['id'] for r in plan['recipes']] == [4, 5, 6, 7]
+
+        status = client.get(f'/meal-plans/{plan_id}/ai-status')
+        assert status.get_json() == {'pending': False}
+
+    def test_swap_recipe_cancels_pending_ai_selection(self, client, sample_recipes, monkeypatch):
+        """Test a late AI selection does not overwrite recipes the user swapped."""
+        save_recipes(sample_recipes)
+        plan = {
+            'id': 1,
+            'created_at': datetime.now().isoformat(),
+            'start_date': '2024-01-08',
+            'days': 2,
+            'recipes': [sample_recipes[0], sample_recipes[1]],
+            'grocery_list': [],
+            'status': 'staged',
+            'ai_pending': True
+        }
+        save_meal_plans([plan])
+
+        assert client.get('/meal-plans/1/ai-status').get_json() == {'pending': True}
+        assert b'aiPendingNotice' in client.get('/meal-plans/1/stage').data
+        response = client.post('/meal-plans/1/swap',
+                             json={'day_index': 0, 'new_recipe_id': 3})
+        assert response.status_code == 200
+
+        monkeypatch.setattr(app_module, 'generate_meal_plan_with_ai', Mock(return_value=sample_recipes[5:7]))
+        app_module._complete_ai_selection(1, sample_recipes, 2, [])
+
+        stored_plan = app_module.get_meal_plan_by_id(1)
+        assert [r['id'] for r in stored_plan['recipes']] == [3, 2]
+
+    def test_late_ai_selection_does_not_restore_deleted_plan(self, client, sample_recipes, monkeypatch):
+        """Test a background AI selection finishing after a delete leaves the plan deleted."""
+        save_meal_plans([{
+            'id': 1,
+            'created_at': datetime.now().isoformat(),
+            'start_date': '2024-01-08',
+            'days': 2,
+            'recipes': [sample_recipes[0], sample_recipes[1]],
+            'grocery_list': [],
+            'status': 'staged',
+            'ai_pending': True
+        }])
+
+        assert client.post('/meal-plans/1/delete').status_code == 200
+
+        monkeypatch.setattr(app_module, 'generate_meal_plan_with_ai', Mock(return_value=sample_recipes[5:7]))
+        app_module._complete_ai_selection(1, sample_recipes, 2, [])
+
+        assert load_meal_plans() == []
+
     def test_view_meal_plan_success(self, client, sample_meal_plan):
         """Test viewing a specific meal plan."""
         save_meal_plans([sample_meal_plan])
@@ -533,14 +677,13 @@ class TestMealPlansRoutes:
         save_meal_plans([plan])
 
         response = client.post('/meal-plans/1/swap',
-                             data=json.dumps({
+                             json={
                                  'day_index': 1,
                                  'custom_recipe_name': "McDonald's"
-                             }),
-                             content_type='application/json')
+                             })
 
         assert response.status_code == 200
-        data = json.loads(response.data)
+        data = response.get_json()
         assert data['success'] is True
         assert data['recipe']['name'] == "McDonald's"
         assert data['recipe']['is_custom'] is True
@@ -572,6 +715,20 @@ class TestMealPlansRoutes:
         assert b"McDonald&#39;s" in response.data
         assert b'Custom meal' in response.data
 
+    def test_concurrent_deletes_are_not_undone(self, client):
+        """Test concurrent meal plan deletes each persist instead of restoring each other's plans."""
+        save_meal_plans([
+            {'id': plan_id, 'created_at': f'2024-01-0{plan_id}T12:00:00', 'recipes': [], 'status': 'staged'}
+            for plan_id in range(1, 9)
+        ])
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(lambda plan_id: client.post(f'/meal-plans/{plan_id}/delete'),
+                                          range(1, 9)))
+
+        assert [response.status_code for response in responses] == [200] * 8
+        assert load_meal_plans() == []
+
 
 class TestHealthEndpoint:
     """Tests for health check endpoint."""
@@ -581,10 +738,31 @@ class TestHealthEndpoint:
         response = client.get('/health')
         assert response.status_code == 200
 
-        data = json.loads(response.data)
+        data = response.get_json()
         assert data['status'] == 'healthy'
 
+    def test_json_responses_use_orjson_provider(self, client):
+        """Test JSON responses are serialized by the orjson-backed provider."""
+        assert isinstance(app_module.app.json, app_module.OrjsonProvider)
+
+        response = client.get('/health')
+        assert response.mimetype == 'application/json'
+        assert response.get_json() == {'status': 'healthy'}
+
+    def test_request_bodies_are_parsed_by_orjson_provider(self, client):
+        """Test JSON request bodies are decoded through the orjson-backed provider."""
+        recipe = {'name': 'Tacos', 'category': 'Beef', 'ingredients': [], 'instructions': ''}
+
+        body = json.dumps(recipe).encode()
+
+        with patch.object(app_module.app.json, 'loads', wraps=app_module.app.json.loads) as loads:
+            response = client.post('/recipes/add', data=body, content_type='application/json')
+
+        assert response.status_code == 200
+        loads.assert_any_call(body)
+
 
+@pytest.mark.integration
 class TestIntegration:
     """Integration tests for complete workflows."""
 
@@ -602,18 +780,16 @@ class TestIntegration:
         }
 
         response = client.post('/recipes/add',
-                             data=json.dumps(recipe_data),
-                             content_type='application/json')
+                             json=recipe_data)
         assert response.status_code == 200
 
         # Step 2: Generate meal plan
         plan_request = {'days': 1, 'use_ai': False}
         response = client.post('/meal-plans/generate',
-                             data=json.dumps(plan_request),
-                             content_type='application/json')
+                             json=plan_request)
         assert response.status_code == 200
 
-        plan_data = json.loads(response.data)
+        plan_data = response.get_json()
         plan_id = plan_data['id']
 
         # Step 3: View the meal plan
@@ -630,11 +806,9 @@ class TestIntegration:
         for i in range(3):
             plan_request = {'days': 5, 'use_ai': False}
             response = client.post('/meal-plans/generate',
-                                 data=json.dumps(plan_request),
-                                 content_type='application/json')
+                                 json=plan_request)
             assert response.status_code == 200
 
         # Verify all plans exist
-        from app import load_meal_plans
         plans = load_meal_plans()
         assert len(plans) == 3
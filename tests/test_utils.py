@@ -1,10 +1,16 @@
 """Unit tests for utility functions in app.py."""
 import json
 import os
+import random
+
 import pytest
 from datetime import datetime
+
+import app as app_module
 from app import (
     load_recipes, save_recipes, load_meal_plans, save_meal_plans,
+    get_recipe_by_id, get_meal_plan_by_id, load_main_dishes, load_main_dish_keys,
+    load_meal_plans_newest_first,
     select_recipes_for_week, generate_grocery_list
 )
 
@@ -37,6 +43,171 @@ class TestDataPersistence:
         assert len(loaded_plans) == 1
         assert loaded_plans[0]['id'] == sample_meal_plan['id']
 
+    def test_save_recipes_writes_compact_json_atomically(self, app, sample_recipes):
+        """Test saves replace the file with compact JSON and leave no temp files."""
+        save_recipes(sample_recipes)
+
+        with open(app_module.RECIPES_FILE, 'rb') as f:
+            contents = f.read()
+        assert b'\n' not in contents
+        assert json.loads(contents) == sample_recipes
+        assert sorted(os.listdir(app_module.DATA_DIR)) == ['recipes.json', 'users.json']
+
+    def test_save_recipes_keeps_existing_file_permissions(self, app, sample_recipes):
+        """Test replacing a store keeps the permission bits of the file it replaces."""
+        save_recipes(sample_recipes)
+        os.chmod(app_module.RECIPES_FILE, 0o644)
+
+        save_recipes(sample_recipes[:1])
+
+        assert os.stat(app_module.RECIPES_FILE).st_mode & 0o777 == 0o644
+
+    def test_save_recipes_creates_new_file_with_umask_mode(self, app, sample_recipes):
+        """Test a store written for the first time gets the umask-based mode rather than 0600."""
+        umask = os.umask(0)
+        os.umask(umask)
+
+        save_recipes(sample_recipes)
+
+        assert os.stat(app_module.RECIPES_FILE).st_mode & 0o777 == 0o666 & ~umask
+
+    def test_failed_save_does_not_serve_unsaved_changes(self, app, sample_recipes, monkeypatch):
+        """Test an in-place edit whose save fails is not served from the cache afterwards."""
+        save_recipes(sample_recipes[:2])
+
+        def fail_write(path, document):
+            raise OSError('No space left on device')
+
+        monkeypatch.setattr(app_module, '_write_json_atomically', fail_write)
+        recipes = load_recipes()
+        recipes.append(sample_recipes[2])
+        with pytest.raises(OSError):
+            save_recipes(recipes)
+
+        assert [r['id'] for r in load_recipes()] == [1, 2]
+
+    def test_save_recipes_indents_when_debug_json_enabled(self, app, sample_recipes, monkeypatch):
+        """Test DEBUG_JSON switches saved stores to indented output."""
+        monkeypatch.setattr(app_module, 'DEBUG_JSON', True)
+        save_recipes(sample_recipes)
+
+        with open(app_module.RECIPES_FILE, 'rb') as f:
+            assert f.read().startswith(b'[\n  {')
+
+    def test_secret_key_persists_in_data_dir(self, app, monkeypatch):
+        """Test a generated secret key is written once and reused on later starts."""
+        monkeypatch.delenv('SECRET_KEY', raising=False)
+
+        key = app_module._load_secret_key()
+        assert len(key) == 32
+        assert app_module._load_secret_key() == key
+        assert os.path.exists(os.path.join(app_module.DATA_DIR, '.secret_key'))
+
+        monkeypatch.setenv('SECRET_KEY', 'from-env')
+        assert app_module._load_secret_key() == 'from-env'
+
+    def test_secret_key_replaces_empty_key_file(self, app, monkeypatch):
+        """Test an empty key file left by an interrupted write is replaced with a full key."""
+        monkeypatch.delenv('SECRET_KEY', raising=False)
+        key_file = os.path.join(app_module.DATA_DIR, '.secret_key')
+        open(key_file, 'wb').close()
+
+        key = app_module._load_secret_key()
+
+        assert len(key) == 32
+        with open(key_file, 'rb') as f:
+            assert f.read() == key
+        assert not [name for name in os.listdir(app_module.DATA_DIR) if name.startswith('.tmp-')]
+
+    def test_load_recipes_reuses_cache_until_file_changes(self, app, sample_recipes):
+        """Test cached recipes are reused until the file is rewritten externally."""
+        save_recipes(sample_recipes)
+        assert load_recipes() is load_recipes()
+
+        with open(app_module.RECIPES_FILE, 'w') as f:
+            json.dump([{'id': 99, 'name': 'Edited Elsewhere'}], f)
+
+        reloaded = load_recipes()
+        assert [r['id'] for r in reloaded] == [99]
+
+    def test_get_by_id_helpers_follow_saved_data(self, app, sample_recipes, sample_meal_plan):
+        """Test ID lookups reflect the latest saved recipes and meal plans."""
+        save_recipes(sample_recipes)
+        save_meal_plans([sample_meal_plan])
+
+        assert get_recipe_by_id(2)['name'] == 'Chicken Curry'
+        assert get_meal_plan_by_id(1) is load_meal_plans()[0]
+        assert get_recipe_by_id(999) is None
+
+        save_recipes(sample_recipes[2:])
+        assert get_recipe_by_id(2) is None
+        assert get_recipe_by_id(3)['name'] == 'Caesar Salad'
+
+    def test_store_index_is_not_attached_to_a_newer_save(self, app):
+        """Test an index built from a list loaded before a concurrent save is not cached for the new list."""
+        save_meal_plans([{'id': 1, 'name': 'Old'}, {'id': 2, 'name': 'Kept'}])
+
+        def load_then_concurrent_delete():
+            meal_plans = load_meal_plans()
+            save_meal_plans([plan for plan in meal_plans if plan['id'] != 1])
+            return meal_plans
+
+        app_module._get_store_index(app_module.MEAL_PLANS_FILE, 'by_id', app_module._index_by_id,
+                                    loader=load_then_concurrent_delete)
+
+        assert get_meal_plan_by_id(1) is None
+        assert get_meal_plan_by_id(2) is load_meal_plans()[0]
+
+    def test_load_meal_plans_newest_first_tracks_saves(self, app):
+        """Test the newest-first ordering is cached and refreshed on save."""
+        plans = [
+            {'id': 1, 'created_at': '2024-01-01T12:00:00'},
+            {'id': 2, 'created_at': '2024-01-08T12:00:00'}
+        ]
+        save_meal_plans(plans)
+
+        newest_first = load_meal_plans_newest_first()
+        assert [p['id'] for p in newest_first] == [2, 1]
+        assert load_meal_plans_newest_first() is newest_first
+
+        plans.append({'id': 3, 'created_at': '2024-01-15T12:00:00'})
+        save_meal_plans(plans)
+        assert [p['id'] for p in load_meal_plans_newest_first()] == [3, 2, 1]
+
+    def test_next_record_id_tracks_inserts_and_external_changes(self, app, sample_recipes):
+        """Test new IDs come from the cached max-ID and follow store rewrites."""
+        save_recipes(sample_recipes)
+        next_id = app_module._next_record_id(app_module.RECIPES_FILE)
+        assert next_id == max(r['id'] for r in sample_recipes) + 1
+
+        save_recipes(load_recipes() + [{'id': next_id, 'name': 'New'}])
+        app_module._record_new_id(app_module.RECIPES_FILE, next_id)
+        assert app_module._next_record_id(app_module.RECIPES_FILE) == next_id + 1
+
+        save_recipes(sample_recipes[:1])
+        assert app_module._next_record_id(app_module.RECIPES_FILE) == sample_recipes[0]['id'] + 1
+
+    def test_load_main_dishes_follows_saved_recipes(self, app, sample_recipes):
+        """Test main dish filtering is cached and refreshed when recipes change."""
+        dessert = {'id': 99, 'name': 'Brownies', 'category': 'Dessert', 'ingredients': []}
+        save_recipes(sample_recipes + [dessert])
+
+        main_dishes = load_main_dishes()
+        assert [r['id'] for r in main_dishes] == [r['id'] for r in sample_recipes]
+        assert load_main_dishes() is main_dishes
+
+        save_recipes([dessert])
+        assert load_main_dishes() == []
+
+    def test_load_main_dish_keys_normalizes_names(self, app):
+        """Test main dish match keys are lowercased once and not written to the store."""
+        save_recipes([{'id': 1, 'name': '  Beef Tacos ', 'category': 'Beef', 'ingredients': []}])
+
+        keys = load_main_dish_keys()
+        assert [(recipe_id, name) for _, recipe_id, name in keys] == [(1, 'beef tacos')]
+        assert load_main_dish_keys() is keys
+        assert load_recipes()[0]['name'] == '  Beef Tacos '
+
 
 class TestRecipeSelection:
     """Tests for recipe selection logic."""
@@ -59,6 +230,14 @@ class TestRecipeSelection:
         result = select_recipes_for_week(sample_recipes[:3], None, 7)
         assert len(result) == 3
     
+    def test_select_recipes_all_recipes_used_once(self, sample_recipes):
+        """Test that using every recipe returns each exactly once without reordering the input."""
+        recipes = sample_recipes[:3]
+        original_ids = [r['id'] for r in recipes]
+        result = select_recipes_for_week(recipes, None, 7, main_dishes_only=True)
+        assert sorted(r['id'] for r in result) == sorted(original_ids)
+        assert [r['id'] for r in recipes] == original_ids
+    
     def test_select_recipes_fewer_days(self, sample_recipes):
         """Test selecting fewer days than available recipes."""
         result = select_recipes_for_week(sample_recipes, None, 3)
@@ -75,6 +254,32 @@ class TestRecipeSelection:
         # Just ensure we get a valid result
         assert all(r in sample_recipes for r in result)
     
+    def test_select_recipes_penalizes_recent_recipes(self, sample_recipes):
+        """Test recently used recipes are picked far less often."""
+        random.seed(1234)
+        previous = [sample_recipes[0]] * 7
+        recent_picks = sum(
+            select_recipes_for_week(sample_recipes[:2], previous, 1)[0]['id'] == sample_recipes[0]['id']
+            for _ in range(200)
+        )
+        assert recent_picks < 10
+
+    def test_select_recipes_large_pool_single_pass(self):
+        """Test large pools use one-pass sampling with unique, weighted picks."""
+        random.seed(4321)
+        pool = [{'id': i, 'name': f'Recipe {i}', 'category': 'Beef'} for i in range(1, 81)]
+        previous = [pool[0]] * 7
+
+        recent_picks = 0
+        for _ in range(50):
+            result = select_recipes_for_week(pool, previous, 7)
+            recipe_ids = [r['id'] for r in result]
+            assert len(recipe_ids) == 7
+            assert len(set(recipe_ids)) == 7
+            recent_picks += 1 in recipe_ids
+
+        assert recent_picks < 5
+
     def test_select_recipes_deterministic_uniqueness(self, sample_recipes):
         """Test that selection doesn't include duplicates within a week."""
         for _ in range(10):  # Run multiple times
@@ -175,6 +380,31 @@ class TestGroceryList:
         assert len(eggs_items) == 1
         assert eggs_items[0]['quantity'] == 5
     
+    def test_generate_grocery_list_separates_units(self):
+        """Test that quantities are only aggregated within the same unit."""
+        recipes = [
+            {
+                'name': 'Recipe 1',
+                'ingredients': [
+                    {'item': 'butter', 'quantity': 2, 'unit': 'tbsp'}
+                ]
+            },
+            {
+                'name': 'Recipe 2',
+                'ingredients': [
+                    {'item': 'butter', 'quantity': 100, 'unit': 'g'},
+                    {'item': 'butter', 'quantity': 1, 'unit': 'tbsp'}
+                ]
+            }
+        ]
+
+        result = generate_grocery_list(recipes)
+        assert [(item['item'], item['unit'], item['quantity']) for item in result] == [
+            ('butter', 'g', 100),
+            ('butter', 'tbsp', 3)
+        ]
+        assert result[1]['recipes'] == ['Recipe 1', 'Recipe 2']
+
     def test_generate_grocery_list_missing_quantity(self):
         """Test handling of ingredients without quantity."""
         recipes = [
@@ -192,3 +422,48 @@ class TestGroceryList:
         salt = next((item for item in result if item['item'] == 'salt'), None)
         assert salt is not None
         assert salt['quantity'] == 0
+
+
+class TestPlanDayLabels:
+    """Tests for meal plan day labels."""
+
+    def test_plan_day_labels_cross_month_boundary(self):
+        """Test day names and ISO dates for consecutive plan days."""
+        labels = app_module._plan_day_labels('2024-01-30', 3)
+        assert labels == [
+            ('Tuesday', '2024-01-30'),
+            ('Wednesday', '2024-01-31'),
+            ('Thursday', '2024-02-01')
+        ]
+
+    def test_plan_day_labels_accepts_unpadded_start_date(self):
+        """Test older unpadded start dates still produce ISO labels."""
+        assert app_module._plan_day_labels('2024-1-5', 1) == [('Friday', '2024-01-05')]
+
+
+class TestRecentPlanRecipes:
+    """Tests for recipes used in plans overlapping the lookback window."""
+
+    def test_recipes_used_in_recent_plans_checks_overlap(self):
+        """Test only plans overlapping the window contribute recipe keys."""
+        meal_plans = [
+            {'start_date': '2024-01-01', 'days': 28, 'recipes': [{'id': 1, 'name': 'Long Plan'}]},
+            {'start_date': '2024-01-08', 'days': 7, 'recipes': [{'id': 2, 'name': 'Too Old'}]},
+            {'start_date': '2024-01-25', 'days': 7, 'recipes': [{'id': 3, 'name': 'Recent'}]},
+            {'start_date': '2024-02-01', 'days': 7, 'recipes': [{'id': 4, 'name': 'Same Day'}]},
+            {'start_date': 'not-a-date', 'recipes': [{'id': 5, 'name': 'Undated'}]}
+        ]
+        date_ranges = app_module._index_plan_date_ranges(meal_plans)
+
+        used_ids, used_names = app_module._recipes_used_in_recent_plans(date_ranges, datetime(2024, 2, 1).date())
+        assert used_ids == {1, 3}
+        assert used_names == {'long plan', 'recent'}
+
+    def test_parse_plan_start_date_formats(self):
+        """Test ISO, datetime-prefixed, unpadded and missing start dates."""
+        parse = app_module._parse_plan_start_date
+        assert parse({'start_date': '2024-03-05'}) == datetime(2024, 3, 5).date()
+        assert parse({'start_date': '2024-03-05T08:00:00'}) == datetime(2024, 3, 5).date()
+        assert parse({'start_date': '2024-3-5'}) == datetime(2024, 3, 5).date()
+        assert parse({'created_at': '2024-03-01T12:00:00'}) == datetime(2024, 3, 1).date()
+        assert parse({'start_date': 'soon'}) is None
@@ -2,6 +2,7 @@
 
 import json
 import os
+import threading
 from datetime import datetime, timedelta
 import logging
 
@@ -23,6 +24,62 @@ TOKEN_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 't
 # OAuth redirect URI - must match what's configured in Google Cloud Console
 REDIRECT_URI = 'http://localhost:5001/oauth2callback'
 
+# Google API batch requests may carry at most 50 calls
+CALENDAR_BATCH_LIMIT = 50
+
+# Built services are reused per thread (their HTTP transport is not thread-safe) until token.json changes
+_SERVICE_CACHE = threading.local()
+# (token.json signature, credentials parsed from it) for authorization status checks
+_TOKEN_CREDENTIALS = (None, None)
+# (credentials.json signature, client config parsed from it) for building OAuth flows
+_CLIENT_CONFIG = (None, None)
+
+
+def _file_signature(path):
+    """Return a signature that changes whenever the file is rewritten, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _token_signature():
+    return _file_signature(TOKEN_FILE)
+
+
+def _build_flow(state=None):
+    """Build an OAuth flow, parsing credentials.json only when it changes."""
+    global _CLIENT_CONFIG
+
+    # Flows carry per-request state, so only the parsed client config is reused
+    signature = _file_signature(CREDENTIALS_FILE)
+    cached_signature, client_config = _CLIENT_CONFIG
+    if client_config is None or cached_signature != signature:
+        with open(CREDENTIALS_FILE, 'r') as credentials_file:
+            client_config = json.load(credentials_file)
+        _CLIENT_CONFIG = (signature, client_config)
+
+    return Flow.from_client_config(
+        client_config,
+        scopes=SCOPES,
+        redirect_uri=REDIRECT_URI,
+        state=state
+    )
+
+
+def _execute_in_batches(service, calls, callback):
+    """
+    Send (request_id, API request) pairs in as few HTTP round trips as possible.
+
+    The callback receives (request_id, response, exception) for every call.
+    """
+    for start in range(0, len(calls), CALENDAR_BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=callback)
+        for request_id, call in calls[start:start + CALENDAR_BATCH_LIMIT]:
+            batch.add(call, request_id=request_id)
+        batch.execute()
+
 
 def get_calendar_service():
     """
@@ -31,6 +88,11 @@ def get_calendar_service():
     Returns:
         Google Calendar service object or None if authentication fails
     """
+    signature = _token_signature()
+    cached = getattr(_SERVICE_CACHE, 'entry', None)
+    if signature is not None and cached and cached[0] == signature and cached[1].valid:
+        return cached[2]
+
     creds = None
 
     # Check if we have a valid token
@@ -57,6 +119,8 @@ def get_calendar_service():
 
     try:
         service = build('calendar', 'v3', credentials=creds)
+        # A refresh above rewrote token.json, so take the signature again
+        _SERVICE_CACHE.entry = (_token_signature(), creds, service)
         return service
     except Exception as e:
         print(f"Error building calendar service: {e}")
@@ -77,11 +141,7 @@ def get_authorization_url(state):
         return None
 
     try:
-        flow = Flow.from_client_secrets_file(
-            CREDENTIALS_FILE,
-            scopes=SCOPES,
-            redirect_uri=REDIRECT_URI
-        )
+        flow = _build_flow()
         authorization_url, _ = flow.authorization_url(
             access_type='offline',
             include_granted_scopes='true',
@@ -111,12 +171,7 @@ def exchange_code_for_token(code, state):
         }
 
     try:
-        flow = Flow.from_client_secrets_file(
-            CREDENTIALS_FILE,
-            scopes=SCOPES,
-            redirect_uri=REDIRECT_URI,
-            state=state
-        )
+        flow = _build_flow(state=state)
         flow.fetch_token(code=code)
         creds = flow.credentials
 
@@ -156,26 +211,28 @@ def add_meal_plan_to_calendar(meal_plan, calendar_id='primary'):
         }
 
     try:
-        start_date = datetime.strptime(meal_plan.get('start_date'), '%Y-%m-%d')
+        start_date_str = meal_plan.get('start_date')
+        try:
+            start_date = datetime.fromisoformat(start_date_str)
+        except ValueError:
+            # Older plans may carry unpadded dates that only strptime accepts
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
         recipes = meal_plan.get('recipes', [])
-        event_ids = []
+        inserts = []
 
         for i, recipe in enumerate(recipes):
-            meal_date = start_date + timedelta(days=i)
-
-            # Create event for dinner time (5 PM)
-            event_start = meal_date.replace(hour=17, minute=0, second=0)
-            event_end = event_start + timedelta(hours=1)
+            meal_date = (start_date + timedelta(days=i)).date().isoformat()
 
             event = {
                 'summary': f'🍽️ Dinner: {recipe.get("name")}',
                 'description': recipe.get('description', '') + '\n\nFrom AI Meal Planner',
+                # Dinner runs from 5 PM to 6 PM
                 'start': {
-                    'dateTime': event_start.isoformat(),
+                    'dateTime': f'{meal_date}T17:00:00',
                     'timeZone': 'America/Denver',
                 },
                 'end': {
-                    'dateTime': event_end.isoformat(),
+                    'dateTime': f'{meal_date}T18:00:00',
                     'timeZone': 'America/Denver',
                 },
                 'reminders': {
@@ -186,8 +243,21 @@ def add_meal_plan_to_calendar(meal_plan, calendar_id='primary'):
                 },
             }
 
-            created_event = service.events().insert(calendarId=calendar_id, body=event).execute()
-            event_ids.append(created_event.get('id'))
+            inserts.append((str(i), service.events().insert(calendarId=calendar_id, body=event)))
+
+        # Insert all events in one batch request instead of one round trip per day
+        event_ids = [None] * len(inserts)
+        errors = []
+
+        def record_insert(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+            else:
+                event_ids[int(request_id)] = response.get('id')
+
+        _execute_in_batches(service, inserts, record_insert)
+        if errors:
+            raise errors[0]
 
         return {
             'success': True,
@@ -230,11 +300,14 @@ def remove_meal_plan_from_calendar(event_ids, calendar_id='primary'):
         }
 
     try:
-        for event_id in event_ids:
-            try:
-                service.events().delete(calendarId=calendar_id, eventId=event_id).execute()
-            except HttpError as e:
-                print(f"Error deleting event {event_id}: {e}")
+        def report_delete(request_id, response, exception):
+            if exception is not None:
+                print(f"Error deleting event {event_ids[int(request_id)]}: {exception}")
+
+        # Batch request IDs must be unique, so key each delete by its position
+        deletes = [(str(i), service.events().delete(calendarId=calendar_id, eventId=event_id))
+                   for i, event_id in enumerate(event_ids)]
+        _execute_in_batches(service, deletes, report_delete)
 
         return {
             'success': True,
@@ -265,11 +338,19 @@ def is_calendar_authorized():
     Returns:
         Boolean indicating if valid token exists
     """
-    if not os.path.exists(TOKEN_FILE):
-        return False
+    global _TOKEN_CREDENTIALS
 
-    try:
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-        return creds and creds.valid
-    except Exception:
+    signature = _token_signature()
+    if signature is None:
         return False
+
+    # Parse token.json only when it changes; expiry is still checked on every call
+    cached_signature, creds = _TOKEN_CREDENTIALS
+    if cached_signature != signature:
+        try:
+            creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+        except Exception:
+            creds = None
+        _TOKEN_CREDENTIALS = (signature, creds)
+
+    return bool(creds and creds.valid)
@@ -0,0 +1,4 @@
+"""WSGI entry point for production servers such as gunicorn."""
+from app import app
+
+application = app